@@ -0,0 +1,288 @@
+import numpy as np
+
+from classes.Needle import polar2cart_arrays, calc_dd_potential_arrays, calc_sphere_dd_potential_arrays
+from classes.Needles import SPHERE_PAIRS_PER_CHUNK, get_offsets
+
+# The number of needles which are traversed through the tree at once.
+_TARGETS_PER_CHUNK = 4096
+
+
+class DipoleTree:
+
+    def __init__(self, needles, p):
+        """
+        Class that calculates the dipole-dipole potential with a Barnes-Hut tree.
+        The octree is built once over the fixed middle spheres of the needles. Every node stores the sum of the
+        moments of its needles, which is updated along the path to the root when one needle rotates.
+        A node of size s at the distance d of a needle is used as one dipole if s < p.tree_accuracy * d,
+        otherwise its children are used (p.tree_accuracy = 0 is the direct summation).
+
+        :param needles: The needles of the system. (class: Needles)
+        :param p: The parameters of the system. (class: Parameters)
+        """
+
+        self.accuracy = p.tree_accuracy
+        self.leaf_size = max(1, p.tree_leaf_size)
+
+        self.positions = needles.get_positions()
+        n = len(self.positions)
+        self.charges = needles.charges[:n].copy()
+
+        # The shapes of the needles (buckets) and the number of dipoles of every needle.
+        self.multiple_dipoles = p.multiple_dipoles
+        self.shapes = list(needles.shapes)
+        self.shape_ids = needles.shape_ids[:n].copy()
+        if p.multiple_dipoles:
+            self.counts = np.array([2 * l + 1 for l, r in self.shapes])[self.shape_ids]
+            self.extent = max(2 * r * l for l, r in self.shapes)   # Needles are not points if every sphere is a dipole.
+        else:
+            self.counts = np.ones(n)
+            self.extent = 0
+
+        # Tree
+        # -----------------------------
+        self.order = np.arange(n)   # The needle ids sorted so that every node is one range of this array.
+        self.start = []             # The first index (in self.order) of every node.
+        self.end = []               # The last index (exclusive) of every node.
+        self.size = []              # The largest side of the bounding box of every node.
+        self.children = []          # The 8 children of every node. (-1 if there is none)
+        self.parent = []            # The parent of every node. (-1 for the root)
+
+        self.build()
+
+        self.start = np.array(self.start)
+        self.end = np.array(self.end)
+        self.size = np.array(self.size)
+        self.children = np.array(self.children).reshape(-1, 8)
+        self.parent = np.array(self.parent)
+        self.is_leaf = np.all(self.children < 0, axis=1)
+        self.max_leaf = np.max((self.end - self.start)[self.is_leaf])  # The most needles in one leaf.
+
+        self.rank = np.empty(n, dtype=int)  # The index of every needle in self.order.
+        self.rank[self.order] = np.arange(n)
+
+        self.leaf = np.empty(n, dtype=int)  # The leaf of every needle.
+        for node in np.flatnonzero(self.is_leaf):
+            self.leaf[self.order[self.start[node]:self.end[node]]] = node
+
+        # The expansion center of every node (mean position of its needles).
+        summed = np.vstack([np.zeros((1, 3)), np.cumsum(self.positions[self.order], axis=0)])
+        self.center = (summed[self.end] - summed[self.start]) / np.maximum(self.end - self.start, 1)[:, None]
+        # -----------------------------
+
+        # Moments
+        # -----------------------------
+        self.units = np.zeros((n, 3))                       # The direction of every needle.
+        self.moments = np.zeros((n, 3))                     # The moment of every needle.
+        self.node_moments = np.zeros((len(self.start), 3))  # The sum of all moments of every node.
+        # -----------------------------
+
+        theta, phi = needles.get_orientations()
+        self.set_orientations(theta, phi)
+
+    def build(self):
+        """
+        Builds the octree. Nodes are split into octants of their bounding box until they hold at most
+        p.tree_leaf_size needles.
+        """
+
+        n = len(self.positions)
+        if n == 0:
+            self.add_node(0, 0, 0, -1)
+            return
+
+        stack = [(0, n, self.add_node(0, n, np.ptp(self.positions, axis=0).max(), -1))]
+
+        while stack:
+            a, b, node = stack.pop()
+            if b - a <= self.leaf_size or self.size[node] <= 1e-12:
+                continue
+
+            idx = self.order[a:b]
+            lo = self.positions[idx].min(axis=0)
+            hi = self.positions[idx].max(axis=0)
+            middle = (lo + hi) / 2
+
+            octant = np.sum((self.positions[idx] > middle) * np.array([1, 2, 4]), axis=1)
+            sort = np.argsort(octant, kind="stable")
+            self.order[a:b] = idx[sort]
+            octant = octant[sort]
+
+            bounds = np.searchsorted(octant, np.arange(9)) + a
+            for k in range(0, 8):
+                if bounds[k + 1] > bounds[k]:
+                    sub = self.positions[self.order[bounds[k]:bounds[k + 1]]]
+                    child = self.add_node(bounds[k], bounds[k + 1], np.ptp(sub, axis=0).max(), node)
+                    self.children[8 * node + k] = child
+                    stack.append((bounds[k], bounds[k + 1], child))
+
+    def add_node(self, a, b, size, parent):
+        """
+        Adds one node to the tree.
+
+        :param a: The first index (in self.order) of the node.
+        :param b: The last index (exclusive) of the node.
+        :param size: The largest side of the bounding box.
+        :param parent: The parent of the node.
+
+        :return: The id of the node.
+        """
+
+        self.start.append(a)
+        self.end.append(b)
+        self.size.append(size)
+        self.children.extend([-1] * 8)
+        self.parent.append(parent)
+
+        return len(self.start) - 1
+
+    def set_orientations(self, theta, phi):
+        """
+        Sets the angles of all needles and recalculates the moments of all nodes.
+
+        :param theta: The angles theta of all needles.
+        :param phi: The angles phi of all needles.
+        """
+
+        self.units = polar2cart_arrays(np.asarray(theta, dtype=float), np.asarray(phi, dtype=float), 1)
+        self.moments = self.units * self.charges[:, None]
+
+        weighted = self.moments * self.counts[:, None]
+        summed = np.vstack([np.zeros((1, 3)), np.cumsum(weighted[self.order], axis=0)])
+        self.node_moments = summed[self.end] - summed[self.start]
+
+    def update(self, idx, theta, phi):
+        """
+        Sets the angles of one needle and updates the moments of all nodes above it.
+
+        :param idx: The id of the needle.
+        :param theta: The new angle theta in radians.
+        :param phi: The new angle phi in radians.
+        """
+
+        unit = polar2cart_arrays(theta, phi, 1)
+        moment = unit * self.charges[idx]
+        d_m = (moment - self.moments[idx]) * self.counts[idx]
+
+        self.units[idx] = unit
+        self.moments[idx] = moment
+
+        node = self.leaf[idx]
+        while node >= 0:
+            self.node_moments[node] += d_m
+            node = self.parent[node]
+
+    def calc_dd_energy(self, factor):
+        """
+        Calculates the dipole-dipole potential of the system.
+
+        :param factor: Prefactor of the potential [mue/(4*pi)]
+
+        :return: The dipole-dipole potential.
+        """
+
+        n = len(self.positions)
+        my_sum = 0
+
+        for a in range(0, n, _TARGETS_PER_CHUNK):
+            my_sum += self.calc_target_energy(np.arange(a, min(n, a + _TARGETS_PER_CHUNK)))
+
+        # Every pair was counted twice.
+        return factor * my_sum / 2
+
+    def calc_dd_potential(self, idx, factor):
+        """
+        Calculates the dipole-dipole potential between one needle and all other needles, which only traverses the
+        path of the needle through the tree (about O(log N)). The change of it is the change of the dipole-dipole
+        potential if only the needle rotates. (exact for p.tree_accuracy = 0, otherwise within the error of the tree)
+
+        :param idx: The id of the needle.
+        :param factor: Prefactor of the potential [mue/(4*pi)]
+
+        :return: The dipole-dipole potential of the needle.
+        """
+
+        return factor * self.calc_target_energy(np.array([idx]))
+
+    def calc_target_energy(self, targets):
+        """
+        Sums up the potentials between needles and all other needles. (nodes which are far enough away are used as
+        one dipole)
+
+        :param targets: The needles.
+
+        :return: The sum of the potentials. (without the factor)
+        """
+
+        my_sum = 0
+        nodes = np.zeros(len(targets), dtype=int)
+
+        while len(targets) > 0:
+            r = self.positions[targets] - self.center[nodes]
+            distance = np.sqrt(np.sum(r * r, axis=1))
+
+            rank = self.rank[targets]
+            inside = (self.start[nodes] <= rank) & (rank < self.end[nodes])
+            far = ~inside & (self.size[nodes] + 2 * self.extent < self.accuracy * distance)
+
+            # The node is far away: one dipole.
+            my_sum += np.sum(calc_dd_potential_arrays(self.moments[targets[far]] * self.counts[targets[far], None],
+                                                      self.node_moments[nodes[far]], r[far], 1))
+
+            # The node is a leaf: direct summation.
+            leaf = ~far & self.is_leaf[nodes]
+            my_sum += self.calc_leaf_energy(targets[leaf], nodes[leaf])
+
+            # Otherwise: open the node.
+            opened = ~far & ~leaf
+            children = self.children[nodes[opened]]
+            targets = np.repeat(targets[opened], 8)[children.ravel() >= 0]
+            nodes = children.ravel()[children.ravel() >= 0]
+
+        return my_sum
+
+    def calc_leaf_energy(self, targets, nodes):
+        """
+        Sums up the potentials between needles and all other needles of leaves.
+
+        :param targets: The needles.
+        :param nodes: The leaf of every needle.
+
+        :return: The sum of the potentials.
+        """
+
+        if len(targets) == 0:
+            return 0
+
+        k = np.arange(self.max_leaf)
+        idx = self.start[nodes][:, None] + k[None, :]
+        valid = idx < self.end[nodes][:, None]
+        others = self.order[np.where(valid, idx, 0)]
+        valid &= others != targets[:, None]
+
+        i = np.broadcast_to(targets[:, None], others.shape)[valid]
+        j = others[valid]
+
+        if not self.multiple_dipoles:
+            return np.sum(calc_dd_potential_arrays(self.moments[i], self.moments[j],
+                                                   self.positions[i] - self.positions[j], 1))
+
+        # Every pair of buckets is summed up separately.
+        my_sum = 0
+        pair_ids = self.shape_ids[i] * len(self.shapes) + self.shape_ids[j]
+        for pair_id in np.unique(pair_ids):
+            pair = pair_ids == pair_id
+            offsets_a = get_offsets(*self.shapes[pair_id // len(self.shapes)])
+            offsets_b = get_offsets(*self.shapes[pair_id % len(self.shapes)])
+
+            ii = i[pair]
+            jj = j[pair]
+            chunk = max(1, SPHERE_PAIRS_PER_CHUNK // (len(offsets_a) * len(offsets_b)))
+            for a in range(0, len(ii), chunk):
+                my_sum += np.sum(calc_sphere_dd_potential_arrays(
+                    self.positions[ii[a:a + chunk]], self.units[ii[a:a + chunk]], self.moments[ii[a:a + chunk]],
+                    offsets_a,
+                    self.positions[jj[a:a + chunk]], self.units[jj[a:a + chunk]], self.moments[jj[a:a + chunk]],
+                    offsets_b, 1))
+
+        return my_sum
@@ -0,0 +1,306 @@
+import multiprocessing
+import random
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from classes.Needle import polar2cart_arrays, calc_dd_potential_arrays
+from classes.Needles import check_overlap_arrays
+
+# The state of one worker process. (set by init_worker)
+_worker = {}
+
+
+class DomainDecomposition:
+
+    def __init__(self, needles, p):
+        """
+        Class that splits the box into cells and updates non-adjacent cells (checkerboard) in parallel.
+        The dipole-dipole potential is cut off at p.cutoff_radius. Because only the angles of the needles
+        change during the simulation, every needle stays in its cell.
+
+        :param needles: The needles of the system. (class: Needles)
+        :param p: The parameters of the system. (class: Parameters)
+        """
+
+        self.needles = needles
+        self.p = p
+
+        # Two needles can only overlap if their middle spheres are closer than the length of the longest needle.
+        self.overlap_range = max(2 * r * (2 * l + 1) for l, r in needles.shapes)
+        self.cell_width = max(p.cutoff_radius, self.overlap_range)
+
+        self.positions = needles.get_positions()
+
+        # Every cell is at least as wide as the interaction and overlap range.
+        self.n_cells = np.maximum((p.box_dimensions // self.cell_width).astype(int), 1)
+        cell_size = p.box_dimensions / self.n_cells
+
+        cell_idx = np.clip((self.positions // cell_size).astype(int), 0, self.n_cells - 1)
+        flat_idx = np.ravel_multi_index(cell_idx.T, self.n_cells)
+
+        self.cells = []         # The needle ids of every cell.
+        self.neighbours = []    # The needle ids of every cell and its adjacent cells.
+        self.sub_lattices = [[] for _ in range(8)]  # The non-empty cells of every checkerboard sub-lattice.
+
+        for c in range(int(np.prod(self.n_cells))):
+            self.cells.append(np.flatnonzero(flat_idx == c))
+
+        offsets = np.array(np.meshgrid([-1, 0, 1], [-1, 0, 1], [-1, 0, 1], indexing="ij")).reshape(3, -1).T
+
+        for c in range(len(self.cells)):
+            idx = np.array(np.unravel_index(c, self.n_cells))
+
+            adjacent = idx + offsets
+            adjacent = adjacent[np.all((adjacent >= 0) & (adjacent < self.n_cells), axis=1)]
+            adjacent = np.ravel_multi_index(adjacent.T, self.n_cells)
+            self.neighbours.append(np.concatenate([self.cells[a] for a in adjacent]))
+
+            if len(self.cells[c]) > 0:
+                color = idx[0] % 2 + 2 * (idx[1] % 2) + 4 * (idx[2] % 2)
+                self.sub_lattices[color].append(c)
+
+        self.sub_lattices = [cells for cells in self.sub_lattices if cells]
+
+        self.shm = None     # The shared memory which holds the angles of all needles.
+        self.angles = None  # The angles theta (row 0) and phi (row 1) inside the shared memory.
+        self.pool = None    # The worker processes.
+
+        self.attempted = 0  # The number of trial moves of the last sweep.
+        self.accepted = 0   # The number of accepted trial moves of the last sweep.
+
+    def start(self):
+        """
+        Copies the angles of all needles into shared memory and starts the worker processes.
+        """
+
+        n = len(self.needles.get())
+        theta, phi = self.needles.get_orientations()
+
+        self.shm = shared_memory.SharedMemory(create=True, size=max(2 * n * 8, 1))
+        self.angles = np.ndarray((2, n), dtype=float, buffer=self.shm.buf)
+        self.angles[0] = theta
+        self.angles[1] = phi
+
+        state = {
+            "positions": self.positions,
+            "cells": self.cells,
+            "neighbours": self.neighbours,
+            "shapes": np.array(self.needles.shapes).reshape(-1, 2),
+            "shape_ids": self.needles.shape_ids[:n].copy(),
+            "hard_core_model": self.p.hard_core_model,
+            "overlap_range": self.overlap_range,
+            "cutoff": self.p.cutoff_radius,
+            "charge": self.p.charge,
+            "factor": self.p.factor,
+            "kT": self.p.kT,
+            "field_vector": np.asarray(self.p.field_vector, dtype=float),
+            "moves": self.p.dd_moves_per_needle,
+        }
+
+        self.pool = multiprocessing.Pool(self.p.processes, initializer=init_worker, initargs=(self.shm.name, n, state))
+
+    def close(self):
+        """
+        Stops the worker processes and frees the shared memory.
+        """
+
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+        if self.shm is not None:
+            self.angles = None
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def sweep(self, gv):
+        """
+        Performs one sweep. Every sub-lattice is updated once in random order, all cells of the active
+        sub-lattice are updated at the same time by the worker processes.
+
+        :param gv: The global variables (class: GlobalVariables)
+
+        :return: True if at least one new orientation was accepted.
+        """
+
+        sub_lattices = list(self.sub_lattices)
+        random.shuffle(sub_lattices)
+
+        changed = []
+        self.attempted = 0
+        for cells in sub_lattices:
+            tasks = [(c, np.random.randint(2 ** 31)) for c in cells]
+
+            for d_dd, d_f, idx, attempted in self.pool.map(_sweep_cell, tasks):
+                gv.E_DD += d_dd
+                gv.E_F += d_f
+                changed.extend(idx)
+                self.attempted += attempted
+
+        self.accepted = len(changed)
+
+        if not changed:
+            return False
+
+        gv.E_tot = gv.E_DD + gv.E_F
+
+        changed = np.unique(changed)
+        self.needles.set_orientations(changed, self.angles[0, changed], self.angles[1, changed])
+
+        return True
+
+    def calc_total_energy(self, gv):
+        """
+        Calculates the total energy of the current state of the system with the cut off dipole-dipole potential.
+
+        :param gv: The global variables (class: GlobalVariables)
+
+        :return: Total energy of the system.
+        """
+
+        theta, phi = self.needles.get_orientations()
+        moments = polar2cart_arrays(theta, phi, self.p.charge)
+
+        sum_dd = 0
+        for c in range(len(self.cells)):
+            idx = self.cells[c]
+            nb = self.neighbours[c]
+
+            r = self.positions[idx][:, None, :] - self.positions[nb][None, :, :]
+            mask = (nb[None, :] > idx[:, None]) & (np.sum(r * r, axis=2) < self.p.cutoff_radius ** 2)
+            rows, cols = np.nonzero(mask)
+
+            sum_dd += np.sum(calc_dd_potential_arrays(moments[idx[rows]], moments[nb[cols]], r[rows, cols],
+                                                      self.p.factor))
+
+        sum_field = np.sum(moments @ np.asarray(self.p.field_vector, dtype=float))
+
+        gv.E_F = sum_field
+        gv.E_DD = sum_dd
+        return sum_dd + sum_field
+
+    def get_log_str(self):
+        """
+        Creates a log-string with the layout of the cells.
+
+        :returns: log-sting.
+        """
+
+        msg = "\nDomain Decomposition Log\n"
+        msg += "-------------------------------\n"
+        msg += "Cells:\t\t{cells}\n".format(cells=self.n_cells)
+        msg += "Cell Width:\t{width}\n".format(width=self.cell_width)
+        msg += "Sub-lattices:\t{lattices}\n".format(lattices=len(self.sub_lattices))
+        msg += "Processes:\t{processes}\n".format(processes=self.p.processes)
+        msg += "-------------------------------\n"
+
+        return msg
+
+
+def init_worker(shm_name, n, state):
+    """
+    Initializes one worker process.
+
+    :param shm_name: The name of the shared memory which holds the angles of all needles.
+    :param n: The number of needles.
+    :param state: All static data the worker needs (positions, cells, parameters).
+    """
+
+    _worker.update(state)
+    _worker["shm"] = shared_memory.SharedMemory(name=shm_name)
+    _worker["angles"] = np.ndarray((2, n), dtype=float, buffer=_worker["shm"].buf)
+
+
+def _sweep_cell(task):
+    """
+    Performs Metropolis steps for the needles of one cell. All needles within range of this cell lie
+    in this cell or in adjacent cells, which are not updated at the same time.
+
+    :param task: The id of the cell and the seed of the random number generator.
+
+    Returns:
+        - d_dd - The change of the dipole-dipole potential.
+        - d_f - The change of the field potential.
+        - changed - The id of the needle of every accepted move.
+        - attempted - The number of trial moves.
+    """
+
+    c, seed = task
+    w = _worker
+    rng = np.random.default_rng(seed)
+
+    theta = w["angles"][0]
+    phi = w["angles"][1]
+    positions = w["positions"]
+    cell = w["cells"][c]
+
+    d_dd = 0
+    d_f = 0
+    changed = []
+
+    for _ in range(w["moves"] * len(cell)):
+        i = cell[rng.integers(len(cell))]
+        nb = w["neighbours"][c]
+        nb = nb[nb != i]
+
+        r = positions[i] - positions[nb]
+        dist = np.sqrt(np.sum(r * r, axis=1))
+
+        new_theta = np.arccos(2 * rng.random() - 1)
+        new_phi = rng.random() * 2. * np.pi
+        u_new = polar2cart_arrays(new_theta, new_phi, 1)
+
+        # Hard-sphere potential
+        close = nb[dist < w["overlap_range"]]
+        length, radius = w["shapes"][w["shape_ids"][i]]
+        u_close = polar2cart_arrays(theta[close], phi[close], 1)
+        if not check_overlap_arrays(positions[i], u_new, length, radius, positions[close], u_close,
+                                    w["shape_ids"][close], w["shapes"], w["hard_core_model"]):
+            continue
+
+        # Dipole-dipole and field potential
+        near = dist < w["cutoff"]
+        m_old = polar2cart_arrays(theta[i], phi[i], w["charge"])
+        m_new = w["charge"] * u_new
+        m_near = polar2cart_arrays(theta[nb[near]], phi[nb[near]], w["charge"])
+
+        de_dd = np.sum(calc_dd_potential_arrays(m_new, m_near, r[near], w["factor"])
+                       - calc_dd_potential_arrays(m_old, m_near, r[near], w["factor"]))
+        de_f = np.dot(m_new - m_old, w["field_vector"])
+
+        d_e = -(de_dd + de_f)
+
+        if d_e > 0 or np.exp(d_e / w["kT"]) >= rng.random():
+            theta[i] = new_theta
+            phi[i] = new_phi
+            d_dd += de_dd
+            d_f += de_f
+            changed.append(int(i))
+
+    return d_dd, d_f, changed, w["moves"] * len(cell)
+
+
+def get_unsupported_parameters(p):
+    """
+    Gets the parameters which are turned on but not supported in domain decomposition mode.
+    (one dipole per needle, single needle steps and the direct cut off dipole-dipole potential)
+
+    :param p: The parameters of the system. (class: Parameters)
+
+    :return: The names of the parameters.
+    """
+
+    unsupported = []
+    if p.multiple_dipoles:
+        unsupported.append("multiple_dipoles")
+    if p.cluster_moves:
+        unsupported.append("cluster_moves")
+    if p.use_interaction_tensor:
+        unsupported.append("use_interaction_tensor")
+    if p.dipole_solver != "direct":
+        unsupported.append("dipole_solver")
+
+    return unsupported
@@ -0,0 +1,209 @@
+import math
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from classes.Needle import calc_dd_potential_arrays
+
+# The state of one worker process. (set by init_worker)
+_worker = {}
+
+# The maximum number of dipole pairs one worker evaluates at once.
+_PAIRS_PER_BLOCK = 2 ** 21
+
+
+class EnergyAudit:
+
+    def __init__(self, p):
+        """
+        Class that recalculates the total energy from scratch in a pool of worker processes and compares it with
+        the total energy which is tracked during the simulation.
+
+        :param p: The parameters of the system. (class: Parameters)
+        """
+
+        self.p = p
+
+        self.shm = None     # The shared memory which holds positions (rows 0-2), moments (3-5) and owners (6).
+        self.data = None    # The array inside the shared memory.
+        self.pool = None    # The worker processes.
+
+    def start(self, n):
+        """
+        Allocates the shared memory and starts the worker processes.
+
+        :param n: The number of dipoles of the system.
+        """
+
+        self.shm = shared_memory.SharedMemory(create=True, size=max(7 * n * 8, 1))
+        self.data = np.ndarray((7, n), dtype=float, buffer=self.shm.buf)
+
+        cutoff = self.p.cutoff_radius if self.p.domain_decomposition else math.inf
+
+        self.pool = multiprocessing.Pool(self.p.processes, initializer=init_worker,
+                                         initargs=(self.shm.name, n, self.p.factor, cutoff))
+
+    def close(self):
+        """
+        Stops the worker processes and frees the shared memory.
+        """
+
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+        if self.shm is not None:
+            self.data = None
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def calc_total_energy(self, needles, gv):
+        """
+        Calculates the total energy of the current state of the system. The upper triangle of all dipole pairs is
+        split into blocks of rows with about the same number of pairs, which are summed up by the workers.
+
+        :param needles: The needles of the system. (class: Needles)
+        :param gv: The global variables (class: GlobalVariables)
+
+        :return: Total energy of the system.
+        """
+
+        # The domain decomposition always uses one dipole per needle.
+        multiple_dipoles = self.p.multiple_dipoles and not self.p.domain_decomposition
+        positions, moments, owners = needles.get_dipoles(multiple_dipoles)
+        n = len(owners)
+
+        if self.pool is None:
+            self.start(n)
+
+        self.data[0:3] = positions.T
+        self.data[3:6] = moments.T
+        self.data[6] = owners
+
+        # Row i has n - 1 - i pairs, so equal areas of the triangle give equal work.
+        n_blocks = 4 * self.p.processes
+        bounds = np.unique(np.round(n * (1 - np.sqrt(1 - np.arange(n_blocks + 1) / n_blocks))).astype(int))
+        tasks = list(zip(bounds[:-1], bounds[1:]))
+
+        sum_dd = sum(self.pool.map(_audit_rows, tasks))
+
+        _, needle_moments, _ = needles.get_dipoles(False)
+        sum_field = np.sum(needle_moments @ np.asarray(self.p.field_vector, dtype=float))
+
+        gv.E_F = sum_field
+        gv.E_DD = sum_dd
+        return sum_dd + sum_field
+
+    def run(self, needles, gv, i, tree=None):
+        """
+        Recalculates the total energy and logs the drift of the tracked total energy.
+        If p.audit_resync is true the tracked energies are replaced by the recalculated ones.
+
+        :param needles: The needles of the system. (class: Needles)
+        :param gv: The global variables (class: GlobalVariables)
+        :param i: The current step.
+        :param tree: The Barnes-Hut tree of the simulation (class: DipoleTree). The tracked energy is an
+                     approximation of the tree, so it is recalculated with the rebuilt tree instead of exactly.
+                     (the steps only traverse the moved needles, so the drift also contains the error of the tree)
+
+        :return: The drift (tracked total energy - recalculated total energy).
+        """
+
+        e_tot = gv.E_tot
+        e_dd = gv.E_DD
+        e_f = gv.E_F
+
+        if tree is not None:
+            theta, phi = needles.get_orientations()
+            tree.set_orientations(theta, phi)
+            e_tot_new = needles.calc_total_energy(gv, self.p.field_vector, self.p.factor, self.p.multiple_dipoles,
+                                                  self.p.cpu_improve, tree=tree)
+        else:
+            e_tot_new = self.calc_total_energy(needles, gv)
+        drift = e_tot - e_tot_new
+
+        gv.append_energy_drift(i, drift)
+        print(get_str_drift(i, drift, e_tot_new))
+
+        if self.p.audit_resync:
+            gv.E_tot = e_tot_new
+        else:
+            gv.E_DD = e_dd
+            gv.E_F = e_f
+
+        return drift
+
+
+def get_str_drift(i, drift, e_tot):
+    """
+    Makes a string with the result of one energy audit.
+
+    :param i: The current step.
+    :param drift: The drift of the tracked total energy.
+    :param e_tot: The recalculated total energy.
+
+    :return: string.
+    """
+
+    msg = "\n-------------------------------\n"
+    msg += "ENERGY AUDIT (step {step})......\n".format(step=i)
+    msg += "Total Energy: {e_tot}\n".format(e_tot=e_tot)
+    msg += "Drift: {drift}\n".format(drift=drift)
+    msg += "Drift / Total Energy: {drift_norm}\n".format(drift_norm=abs(drift / e_tot) if e_tot else math.inf)
+    msg += "-------------------------------\n"
+
+    return msg
+
+
+def init_worker(shm_name, n, factor, cutoff):
+    """
+    Initializes one worker process.
+
+    :param shm_name: The name of the shared memory which holds the dipoles.
+    :param n: The number of dipoles.
+    :param factor: Prefactor of the potential [mue/(4*pi)]
+    :param cutoff: The range of the dipole-dipole potential.
+    """
+
+    _worker["shm"] = shared_memory.SharedMemory(name=shm_name)
+    _worker["data"] = np.ndarray((7, n), dtype=float, buffer=_worker["shm"].buf)
+    _worker["factor"] = factor
+    _worker["cutoff"] = cutoff
+
+
+def _audit_rows(task):
+    """
+    Sums up the dipole-dipole potential of the rows start ... stop with all following dipoles.
+    Dipoles of the same needle do not interact.
+
+    :param task: The first and the last (exclusive) row.
+
+    :return: The dipole-dipole potential of the rows.
+    """
+
+    start, stop = task
+    data = _worker["data"]
+    n = data.shape[1]
+
+    positions = data[0:3].T
+    moments = data[3:6].T
+    owners = data[6]
+
+    my_sum = 0
+    a = start
+    while a < stop:
+        b = min(stop, a + max(1, _PAIRS_PER_BLOCK // max(n - a, 1)))
+
+        rows = np.arange(a, b)
+        r = positions[a:b, None, :] - positions[None, a:, :]
+        mask = ((np.arange(a, n)[None, :] > rows[:, None]) & (owners[a:b, None] != owners[None, a:])
+                & (np.sum(r * r, axis=2) < _worker["cutoff"] ** 2))
+        i, j = np.nonzero(mask)
+
+        my_sum += np.sum(calc_dd_potential_arrays(moments[a + i], moments[a + j], r[i, j], _worker["factor"]))
+        a = b
+
+    return my_sum
@@ -1,15 +1,20 @@
 import math
 import statistics
 import time
-import matplotlib.pyplot as plt
+
+from classes.RingBuffer import RingBuffer
+from classes.Plotting import get_pyplot, show
 
 
 class GlobalValues:
-    def __init__(self, ci_length):
+    def __init__(self, ci_length, retention=10000, buckets=2000):
         """
         Class that stores all relevant variables generated during the simulation.
+        The energies, steps and mean magnetic potentials are stored with bounded memory (class: RingBuffer).
 
         :param ci_length: The interval where it checks the standard deviation.
+        :param retention: The number of last values which are kept exactly. (at least ci_length)
+        :param buckets: The number of buckets of the decimated values which are used for the plots.
         """
 
         # Info:
@@ -40,14 +45,25 @@ class GlobalValues:
 
         # global arrays
         # -----------------------------
-        self.total_energy_array = []        # Every total energy of the system. (added when change occurs)
-        self.dd_energy_array = []           # Every dipole-dipole potential of the system. (added when change occurs)
-        self.field_energy_array = []        # Every field potential of the system. (added when change occurs)
+        retention = max(retention, ci_length)
+
+        self.total_energy_array = RingBuffer(retention, buckets)        # Every total energy of the system.
+        self.dd_energy_array = RingBuffer(retention, buckets)           # Every dipole-dipole potential.
+        self.field_energy_array = RingBuffer(retention, buckets)        # Every field potential of the system.
 
         self.convergence_interval = []      # The total energies in the current convergence interval.
-        self.mean_magnetic_potential = []   # The mean magnetic potential of every convergence interval.
+        self.mean_magnetic_potential = RingBuffer(retention, buckets)   # The mean magnetic potential of every step.
+
+        self.steps_array = RingBuffer(retention, buckets)               # Every step where a new energy was accepted.
+
+        self.sample_dd_energy = []          # The dipole-dipole potential of every sample. (after convergence)
+        self.sample_moment = []             # The sum of all moments of every sample. (after convergence)
+        self.sample_magnetization = []      # The mean magnetic potential of every sample. (after convergence)
 
-        self.steps_array = []               # Every step where a new total energy was accepted.
+        self.configurations = []            # Every accepted dipole vector. (only if p.store_configurations)
+
+        self.energy_drift_array = []        # The drift of the total energy found by every energy audit.
+        self.audit_steps_array = []         # Every step where an energy audit was done.
         # -----------------------------
 
     def append_mean_magnetic_potential_x(self, x):
@@ -71,6 +87,27 @@ class GlobalValues:
         self.dd_energy_array.append(self.E_DD)
         self.field_energy_array.append(self.E_F)
 
+    def append_sample(self, moment, magnetization):
+        """
+        Appends one sample of the converged system. (used for class Reweighting)
+
+        :param moment: The sum of all moments of the system.
+        :param magnetization: The mean magnetic potential of the system.
+        """
+
+        self.sample_dd_energy.append(self.E_DD)
+        self.sample_moment.append(moment)
+        self.sample_magnetization.append(magnetization)
+
+    def append_configuration(self, dipoles):
+        """
+        Appends a configuration to the array.
+
+        :param dipoles: The stacked dipole vector of the configuration.
+        """
+
+        self.configurations.append(dipoles)
+
     def add_step(self, i):
         """
         Adds a step to the step array.
@@ -80,6 +117,17 @@ class GlobalValues:
 
         self.steps_array.append(i)
 
+    def append_energy_drift(self, i, drift):
+        """
+        Appends the result of one energy audit.
+
+        :param i: The step of the audit.
+        :param drift: The drift of the total energy (tracked - recalculated).
+        """
+
+        self.audit_steps_array.append(i)
+        self.energy_drift_array.append(drift)
+
     def add_ci_step(self):
         """
         Increases the step counter for the convergence interval by 1.
@@ -124,7 +172,7 @@ class GlobalValues:
         :return: current convergence interval.
         """
 
-        return self.total_energy_array[-self.ci_length:]
+        return self.total_energy_array.get_last(self.ci_length)
 
     # Plotting methods
     # -----------------------------
@@ -133,52 +181,28 @@ class GlobalValues:
         Makes a plot of the total energy with respect to time.
         """
 
-        fig = plt.figure(figsize=(15, 10))  # control plot size
-        plt.plot(self.steps_array, self.total_energy_array)
-        plt.xlabel('number of steps')
-        plt.ylabel('energy')
-        plt.show()
-        plt.close(fig)
+        plot_decimated(self.steps_array, self.total_energy_array, 'energy')
 
     def plot_dd_energy(self):
         """
         Makes a plot of the dipole-dipole potential with respect to time.
         """
 
-        fig = plt.figure(figsize=(15, 10))  # control plot size
-        plt.plot(self.steps_array, self.dd_energy_array)
-        plt.xlabel('number of steps')
-        plt.ylabel('dipole dipole energy')
-        plt.show()
-        plt.close(fig)
+        plot_decimated(self.steps_array, self.dd_energy_array, 'dipole dipole energy')
 
     def plot_field_energy(self):
         """
         Makes a plot of the field energy with respect to time.
         """
 
-        fig = plt.figure(figsize=(15, 10))  # control plot size
-        plt.plot(self.steps_array, self.field_energy_array)
-        plt.xlabel('number of steps')
-        plt.ylabel('field energy')
-        plt.show()
-        plt.close(fig)
+        plot_decimated(self.steps_array, self.field_energy_array, 'field energy')
 
     def plot_mean_magnetic_potential(self):
         """
         Makes a plot of the mean magnetic potential with respect to time.
         """
 
-        tmp_x = []
-        for i in range(0, len(self.mean_magnetic_potential)):
-            tmp_x.append(i)
-
-        fig = plt.figure(figsize=(15, 10))  # control plot size
-        plt.plot(tmp_x, self.mean_magnetic_potential)
-        plt.xlabel('number of steps')
-        plt.ylabel('mean magnetic potential')
-        plt.show()
-        plt.close(fig)
+        plot_decimated(None, self.mean_magnetic_potential, 'mean magnetic potential')
 
     # To String methods
     # -----------------------------
@@ -224,7 +248,34 @@ class GlobalValues:
         msg = "\nGlobal Variables Log\n"
         msg += "-------------------------------\n"
         msg += "Time:\t{time} [s]\n".format(time=self.t_end - self.t_start)
-        msg += "Steps:\t{steps}\n".format(steps=self.steps_array[-1])
+        msg += "Steps:\t{steps}\n".format(steps=int(self.steps_array.get_latest()))
         msg += "-------------------------------\n"
 
         return msg
+
+
+def plot_decimated(steps, values, label):
+    """
+    Makes a plot of the decimated values (mean of every bucket, min and max as shaded area).
+
+    :param steps: The steps of the values (class: RingBuffer) or None if there is one value per step.
+    :param values: The values (class: RingBuffer).
+    :param label: The label of the y-axis.
+    """
+
+    index, v_min, v_max, v_mean = values.get_decimated()
+
+    if steps is None:
+        x = index + 1
+    else:
+        x = steps.get_decimated()[1]    # The first step of every bucket.
+
+    plt = get_pyplot()
+
+    fig = plt.figure(figsize=(15, 10))  # control plot size
+    plt.plot(x, v_mean)
+    plt.fill_between(x, v_min, v_max, alpha=0.3)
+    plt.xlabel('number of steps')
+    plt.ylabel(label)
+    show(plt, label.replace(" ", "_"))
+    plt.close(fig)
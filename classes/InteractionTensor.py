@@ -0,0 +1,132 @@
+import numpy as np
+
+# The maximum size of one block of rows in bytes.
+_BLOCK_BYTES = 2 ** 26
+
+
+class InteractionTensor:
+
+    def __init__(self, positions, memory_cap):
+        """
+        Class that holds the 3N x 3N dipole-dipole coupling matrix T of needles with fixed positions, so that the
+        dipole-dipole potential of the stacked dipole vector m is factor/2 * m^T T m.
+        The matrix is split into blocks of rows. T is symmetric, so every block only holds the columns from its own
+        first needle on (the upper triangle of blocks), which is about half of the matrix. Blocks are stored as long
+        as they fit into memory_cap, all other blocks are recalculated for every evaluation.
+        Comment: only for one dipole per needle (the sphere positions change with the angles)
+
+        :param positions: The positions of the middle spheres of all needles. (array of shape N x 3)
+        :param memory_cap: The maximum memory for stored blocks in bytes.
+        """
+
+        self.positions = np.asarray(positions, dtype=float)
+        self.n = len(self.positions)
+
+        row_bytes = 3 * 3 * self.n * 8  # One needle (3 rows) of the matrix.
+        self.block_size = max(1, min(self.n, _BLOCK_BYTES // max(row_bytes, 1)))
+
+        self.blocks = []    # The first and last (exclusive) needle of every block.
+        self.stored = []    # The stored block or None if it has to be recalculated.
+
+        used = 0
+        for a in range(0, self.n, self.block_size):
+            b = min(self.n, a + self.block_size)
+            self.blocks.append((a, b))
+
+            block_bytes = 3 * 3 * (b - a) * (self.n - a) * 8
+            if used + block_bytes <= memory_cap:
+                self.stored.append(self.calc_block(a, b, a, self.n))
+                used += block_bytes
+            else:
+                self.stored.append(None)
+
+    def calc_block(self, a, b, c, d):
+        """
+        Calculates the part of the coupling matrix which couples the needles a ... b (rows) with the needles
+        c ... d (columns).
+
+        :param a: The first needle of the rows.
+        :param b: The last needle of the rows. (exclusive)
+        :param c: The first needle of the columns.
+        :param d: The last needle of the columns. (exclusive)
+
+        :return: The block. (array of shape 3(b-a) x 3(d-c))
+        """
+
+        r = self.positions[a:b, None, :] - self.positions[None, c:d, :]
+        r_norm = np.sqrt(np.sum(r * r, axis=2))
+        r_norm[r_norm == 0] = np.inf  # No self interaction.
+
+        block = (np.eye(3)[None, None, :, :] / r_norm[:, :, None, None] ** 3
+                 - 3 * (r[:, :, :, None] * r[:, :, None, :]) / r_norm[:, :, None, None] ** 5)
+
+        return block.transpose(0, 2, 1, 3).reshape(3 * (b - a), 3 * (d - c))
+
+    def calc_dd_energy(self, dipoles, factor):
+        """
+        Calculates the dipole-dipole potential of one or many configurations.
+
+        :param dipoles: The stacked dipole vectors. (array of length 3N or shape K x 3N)
+        :param factor: Prefactor of the potential [mue/(4*pi)]
+
+        :return: The dipole-dipole potential of every configuration.
+        """
+
+        m = np.atleast_2d(np.asarray(dipoles, dtype=float))
+
+        my_sum = np.zeros(len(m))
+        for (a, b), block in zip(self.blocks, self.stored):
+            if block is None:
+                block = self.calc_block(a, b, a, self.n)
+            # The diagonal block once, the blocks right of it twice (for the blocks below the diagonal).
+            inside = m[:, 3 * a:3 * b] @ block[:, :3 * (b - a)].T
+            right = m[:, 3 * b:] @ block[:, 3 * (b - a):].T
+            my_sum += np.sum(m[:, 3 * a:3 * b] * (inside + 2 * right), axis=1)
+
+        my_sum *= factor / 2
+        return my_sum if np.ndim(dipoles) == 2 else my_sum[0]
+
+    def calc_local_field(self, idx, dipoles):
+        """
+        Calculates T_idx m, the three rows of the coupling matrix which belong to the needle idx times the dipole
+        vector. The dipole-dipole potential changes by factor * (m_new - m_old) * T_idx m if only the moment of idx
+        changes from m_old to m_new. (T_idx,idx = 0)
+
+        :param idx: The id of the needle.
+        :param dipoles: The stacked dipole vector. (array of length 3N)
+
+        :return: T_idx m. (array of length 3)
+        """
+
+        m = np.asarray(dipoles, dtype=float)
+
+        field = np.zeros(3)
+        for (a, b), block in zip(self.blocks, self.stored):
+            if idx >= b:
+                # The columns of idx in an earlier block are the rows of idx. (T is symmetric)
+                if block is None:
+                    field += self.calc_block(idx, idx + 1, a, b) @ m[3 * a:3 * b]
+                else:
+                    field += block[:, 3 * (idx - a):3 * (idx - a + 1)].T @ m[3 * a:3 * b]
+            elif idx >= a:
+                if block is None:
+                    field += self.calc_block(idx, idx + 1, a, self.n) @ m[3 * a:]
+                else:
+                    field += block[3 * (idx - a):3 * (idx - a + 1)] @ m[3 * a:]
+
+        return field
+
+    def calc_field_energy(self, dipoles, field_vector):
+        """
+        Calculates the field potential of one or many configurations.
+
+        :param dipoles: The stacked dipole vectors. (array of length 3N or shape K x 3N)
+        :param field_vector: The vector of the field.
+
+        :return: The field potential of every configuration.
+        """
+
+        m = np.atleast_2d(np.asarray(dipoles, dtype=float))
+        my_sum = m.reshape(len(m), self.n, 3).sum(axis=1) @ np.asarray(field_vector, dtype=float)
+
+        return my_sum if np.ndim(dipoles) == 2 else my_sum[0]
@@ -0,0 +1,103 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MetricsServer:
+
+    def __init__(self, port, host="127.0.0.1"):
+        """
+        Class that serves the metrics of a running simulation on a local port in a background thread.
+            - GET /metrics - Prometheus text format (only the numbers).
+            - GET / or /json - JSON (including the downsampled energies).
+        The simulation only replaces the reference to the current snapshot (publish), so it never waits for
+        the server.
+
+        :param port: The port of the server.
+        :param host: The host of the server.
+        """
+
+        self.snapshot = {}      # The last published metrics. (never changed, only replaced)
+
+        self.httpd = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.metrics = self
+
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def start(self):
+        """
+        Starts the server thread.
+        """
+
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops the server thread and closes the port.
+        """
+
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def publish(self, snapshot):
+        """
+        Publishes new metrics.
+
+        :param snapshot: The metrics. (dict, must not be changed afterwards)
+        """
+
+        self.snapshot = snapshot
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        """
+        Answers one request with the last published metrics.
+        """
+
+        snapshot = self.server.metrics.snapshot
+
+        if self.path == "/metrics":
+            body = get_prometheus_str(snapshot)
+            content_type = "text/plain; version=0.0.4"
+        elif self.path in ("/", "/json"):
+            body = json.dumps(snapshot)
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        """
+        Does not print the requests (the simulation already prints every step).
+        """
+
+        pass
+
+
+def get_prometheus_str(snapshot):
+    """
+    Makes a string in the Prometheus text format with all numbers of the metrics.
+
+    :param snapshot: The metrics.
+
+    :return: string.
+    """
+
+    msg = ""
+    for key, value in snapshot.items():
+        if isinstance(value, bool):
+            value = int(value)
+        if isinstance(value, (int, float)):
+            msg += "mn_simulator_{key} {value}\n".format(key=key, value=value)
+
+    return msg
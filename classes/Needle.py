@@ -33,43 +33,6 @@ class Needle:
         self.data_y = []    # The y position for all spheres.
         self.data_z = []    # The z position for all spheres.
 
-    def check_overlap(self, needles, cpu_improve):
-        """
-        Checks if two needles overlap.
-
-        :param needles: The needle with which this needle is checked for overlapping.
-        :param cpu_improve: Stores all sphere positions fpr HS-Potential instead of recalculating them.
-
-        :return: True if there is no overlap.
-        """
-
-        if cpu_improve:
-            x1, y1, z1 = get_coordinate_from_memory(self)
-        else:
-            x1, y1, z1 = self.get_coordinate()
-
-        r1 = self.radius
-        # *2 because of the definition of the data model and +1 because of the sphere in the middle
-        l1 = (self.length * 2) + 1
-
-        for i in range(0, len(needles)):  # Loop over all needles
-
-            if cpu_improve:
-                x2, y2, z2 = get_coordinate_from_memory(needles[i])
-            else:
-                x2, y2, z2 = needles[i].get_coordinate
-
-            r2 = needles[i].radius
-            l2 = (needles[i].length * 2) + 1
-            for m in range(0, l1):  # Loop over all spheres in the "new" needle
-                for n in range(0, l2):  # Loop over all spheres of the "old" needle
-
-                    distance = np.linalg.norm(np.array([x1[m] - x2[n], y1[m] - y2[n], z1[m] - z2[n]]))
-                    if distance <= r2 + r1:
-                        return False
-
-        return True
-
     def calc_dd_potential(self, other_needle, factor, multiple_dipoles, cpu_improve):
         """
         Calculates the dipole-dipole potential
@@ -203,3 +166,99 @@ def get_coordinate_from_memory(needle):
     """
 
     return needle.data_x, needle.data_y, needle.data_z
+
+
+def polar2cart_arrays(theta, phi, r):
+    """
+    Vectorised version of Needle.polar2cart for arrays of angles.
+
+    :param theta: The angles theta in radians.
+    :param phi: The angles phi in radians.
+    :param r: The length of the vectors.
+
+    :return: The cartesian coordinates. (array, last axis is x, y, z)
+    """
+
+    sin_theta = np.sin(theta)
+
+    return np.stack([
+        r * sin_theta * np.cos(phi),
+        r * sin_theta * np.sin(phi),
+        r * np.cos(theta)
+    ], axis=-1)
+
+
+def calc_dd_potential_arrays(m1, m2, r, factor):
+    """
+    Vectorised version of the dipole-dipole potential. All arrays are broadcast against each other.
+
+    :param m1: The moments of the first dipoles. (last axis is x, y, z)
+    :param m2: The moments of the second dipoles. (last axis is x, y, z)
+    :param r: The distance vectors between the dipoles. (last axis is x, y, z)
+    :param factor: Prefactor of the potential [mue/(4*pi)]
+
+    :return: The potentials between the dipoles.
+    """
+
+    r_norm = np.sqrt(np.sum(r * r, axis=-1))
+
+    return factor * ((np.sum(m1 * m2, axis=-1) / r_norm ** 3)
+                     - 3 * ((np.sum(m1 * r, axis=-1) * np.sum(m2 * r, axis=-1)) / r_norm ** 5))
+
+
+def calc_segment_distances(p1, u1, h1, p2, u2, h2):
+    """
+    Vectorised minimum distance between the line segments p1 + s*u1 (|s| <= h1) and p2 + t*u2 (|t| <= h2).
+    All arrays are broadcast against each other.
+
+    :param p1: The middle points of the first segments. (last axis is x, y, z)
+    :param u1: The unit directions of the first segments. (last axis is x, y, z)
+    :param h1: The half lengths of the first segments.
+    :param p2: The middle points of the second segments. (last axis is x, y, z)
+    :param u2: The unit directions of the second segments. (last axis is x, y, z)
+    :param h2: The half lengths of the second segments.
+
+    :return: The minimum distances.
+    """
+
+    r = p2 - p1
+    b = np.sum(u1 * u2, axis=-1)
+    d1 = np.sum(u1 * r, axis=-1)
+    e = np.sum(u2 * r, axis=-1)
+
+    # Closest points of the infinite lines (s = 0 for parallel lines), then clamped to the segments.
+    denominator = 1 - b * b
+    parallel = denominator < 1e-12
+    s = np.where(parallel, 0, (d1 - b * e) / np.where(parallel, 1, denominator))
+    s = np.clip(s, -h1, h1)
+    t = np.clip(b * s - e, -h2, h2)
+    s = np.clip(d1 + b * t, -h1, h1)
+
+    d = r + t[..., None] * u2 - s[..., None] * u1
+    return np.sqrt(np.sum(d * d, axis=-1))
+
+
+def calc_sphere_dd_potential_arrays(p1, u1, m1, offsets1, p2, u2, m2, offsets2, factor):
+    """
+    Vectorised dipole-dipole potential between pairs of needles where every sphere is a dipole.
+    All first needles have the same shape, and all second needles have the same shape.
+
+    :param p1: The middle points of the first needles. (array of shape n x 3)
+    :param u1: The unit directions of the first needles. (array of shape n x 3)
+    :param m1: The moments of the first needles. (array of shape n x 3)
+    :param offsets1: The offsets of the spheres of the first needles along their direction.
+    :param p2: The middle points of the second needles. (array of shape n x 3)
+    :param u2: The unit directions of the second needles. (array of shape n x 3)
+    :param m2: The moments of the second needles. (array of shape n x 3)
+    :param offsets2: The offsets of the spheres of the second needles along their direction.
+    :param factor: Prefactor of the potential [mue/(4*pi)]
+
+    :return: The potential of every pair. (summed over all spheres)
+    """
+
+    # Distance between sphere k of the first and sphere l of the second needle. (pairs x k x l x 3)
+    r = ((p1 - p2)[:, None, None, :]
+         + offsets1[None, :, None, None] * u1[:, None, None, :]
+         - offsets2[None, None, :, None] * u2[:, None, None, :])
+
+    return np.sum(calc_dd_potential_arrays(m1[:, None, None, :], m2[:, None, None, :], r, factor), axis=(1, 2))
@@ -1,8 +1,12 @@
 import random
 import numpy as np
-import matplotlib.pyplot as plt
 
-from classes.Needle import Needle
+from classes.Needle import Needle, polar2cart_arrays, calc_dd_potential_arrays, calc_segment_distances, \
+    calc_sphere_dd_potential_arrays
+from classes.Plotting import get_pyplot, show
+
+# The maximum number of sphere pairs which are evaluated at once.
+SPHERE_PAIRS_PER_CHUNK = 2 ** 20
 
 
 class Needles:
@@ -17,12 +21,25 @@ class Needles:
         self.needles = []   # The array that holds all needles.
         self.p = p
 
-        calc_length, calc_radius = p.calculate_needle_dimensions()
+        # Info:
+        # -----------------------------
+        # Needles with the same shape (number of spheres and radius) are grouped into buckets,
+        # so the overlap and multiple dipole calculations are vectorised for every pair of buckets.
+        # -----------------------------
 
-        tmp_l = calc_radius * 2 * calc_length
+        self.positions = np.zeros((p.quantity, 3))          # The positions of the middle spheres.
+        self.units = np.zeros((p.quantity, 3))              # The directions of the needles.
+        self.charges = np.zeros(p.quantity)                 # The charges of the needles.
+        self.shape_ids = np.zeros(p.quantity, dtype=int)    # The bucket of every needle.
+        self.shapes = []                                    # The shape (length, radius) of every bucket.
+        self.outdated = set()                               # The needles whose stored sphere positions are old.
 
         for i in range(0, p.quantity):
             print("Placed needle nr.: " + str(i + 1))
+
+            calc_length, calc_radius = p.sample_needle_dimensions()
+            tmp_l = calc_radius * 2 * calc_length
+
             while True:  # Loop as long as it needs till a random position of a needle is accepted.
                 x = random.uniform(tmp_l, p.box_dimensions[0] - tmp_l)
                 y = random.uniform(tmp_l, p.box_dimensions[1] - tmp_l)
@@ -30,7 +47,6 @@ class Needles:
 
                 theta, phi = get_random_parameters()
 
-                # Here the length of each needle can also be randomised
                 needle = Needle(x, y, z, theta, phi, calc_radius, calc_length, p.charge)
 
                 if p.cpu_improve:  # Could also be before the if statement
@@ -39,8 +55,8 @@ class Needles:
                     needle.data_y = data_y
                     needle.data_z = data_z
 
-                if needle.check_overlap(self.needles, p.cpu_improve):
-                    self.needles.append(needle)
+                if self.check_overlap(needle):
+                    self.append(needle)
                     break
 
     def get(self):
@@ -70,9 +86,62 @@ class Needles:
         :param needle: The needle to be appended.
         """
 
+        idx = len(self.needles)
+        if idx >= len(self.positions):
+            self.positions = np.vstack([self.positions, np.zeros((max(idx, 1), 3))])
+            self.units = np.vstack([self.units, np.zeros((max(idx, 1), 3))])
+            self.charges = np.concatenate([self.charges, np.zeros(max(idx, 1))])
+            self.shape_ids = np.concatenate([self.shape_ids, np.zeros(max(idx, 1), dtype=int)])
+
+        shape = (needle.length, needle.radius)
+        if shape not in self.shapes:
+            self.shapes.append(shape)
+
+        self.positions[idx] = [needle.pos_x, needle.pos_y, needle.pos_z]
+        self.charges[idx] = needle.charge
+        self.shape_ids[idx] = self.shapes.index(shape)
         self.needles.append(needle)
+        self.units[idx] = needle.polar2cart(1)
+
+    def replace(self, idx, needle):
+        """
+        Replaces one needle by a needle with the same position and shape.
+
+        :param idx: The id of the needle.
+        :param needle: The new needle.
+        """
+
+        self.needles[idx] = needle
+        self.units[idx] = needle.polar2cart(1)
+
+    def check_overlap(self, needle, idx=None):
+        """
+        Checks if a needle overlaps with any needle of the system. (vectorised for every bucket)
+
+        :param needle: The needle which is checked.
+        :param idx: The id of the needle which is replaced by it. (is not checked)
+
+        :return: True if there is no overlap.
+        """
+
+        n = len(self.needles)
+        if n == 0:
+            return True
+
+        p1 = np.array([needle.pos_x, needle.pos_y, needle.pos_z])
+        u1 = np.array(needle.polar2cart(1))
+        h1 = 2 * needle.radius * needle.length
+
+        # Only needles whose middle spheres are close enough can overlap.
+        reach = h1 + needle.radius + max(2 * r * l + r for l, r in self.shapes)
+        r = self.positions[:n] - p1
+        close = np.flatnonzero(np.sum(r * r, axis=1) <= reach ** 2)
+        close = close[close != idx]
 
-    def calc_total_energy(self, gv, field_vector, factor, multiple_dipoles, cpu_improve):
+        return check_overlap_arrays(p1, u1, needle.length, needle.radius, self.positions[close], self.units[close],
+                                    self.shape_ids[close], self.shapes, self.p.hard_core_model)
+
+    def calc_total_energy(self, gv, field_vector, factor, multiple_dipoles, cpu_improve, tensor=None, tree=None):
         """
         Calculates the total energy of the current state of the system.
 
@@ -81,6 +150,8 @@ class Needles:
         :param factor: Prefactor of the potential [mue/(4*pi)]
         :param multiple_dipoles: Turn to true if every sphere should be a dipole.
         :param cpu_improve: Stores all sphere positions fpr HS-Potential instead of recalculating them.
+        :param tensor: The precomputed coupling matrix (class: InteractionTensor), only for one dipole per needle.
+        :param tree: The Barnes-Hut tree with the current angles of all needles (class: DipoleTree).
 
         :return: Total energy of the system.
         """
@@ -88,6 +159,31 @@ class Needles:
         sum_field = 0
         sum_dd = 0
 
+        if tensor is not None and not multiple_dipoles:
+            dipoles = self.get_dipole_vector()
+            sum_dd = tensor.calc_dd_energy(dipoles, factor)
+            sum_field = tensor.calc_field_energy(dipoles, field_vector)
+
+            gv.E_F = sum_field
+            gv.E_DD = sum_dd
+            return sum_dd + sum_field
+
+        if tree is not None:
+            sum_dd = tree.calc_dd_energy(factor)
+            sum_field = np.sum(tree.moments @ np.asarray(field_vector, dtype=float))
+
+            gv.E_F = sum_field
+            gv.E_DD = sum_dd
+            return sum_dd + sum_field
+
+        if multiple_dipoles:
+            sum_dd = self.calc_multiple_dipoles_energy(factor)
+            sum_field = np.sum(self.get_dipoles(False)[1] @ np.asarray(field_vector, dtype=float))
+
+            gv.E_F = sum_field
+            gv.E_DD = sum_dd
+            return sum_dd + sum_field
+
         for i in range(0, len(self.needles)):
             for j in range(i, len(self.needles)):
                 if i == j:
@@ -100,6 +196,85 @@ class Needles:
         gv.E_DD = sum_dd
         return sum_dd + sum_field
 
+    def calc_multiple_dipoles_energy(self, factor):
+        """
+        Calculates the dipole-dipole potential if every sphere is a dipole. (vectorised for every pair of buckets)
+
+        :param factor: Prefactor of the potential [mue/(4*pi)]
+
+        :return: The dipole-dipole potential.
+        """
+
+        n = len(self.needles)
+        moments = self.units[:n] * self.charges[:n, None]
+
+        my_sum = 0
+        for a in range(0, len(self.shapes)):
+            for b in range(a, len(self.shapes)):
+                idx_a = np.flatnonzero(self.shape_ids[:n] == a)
+                idx_b = np.flatnonzero(self.shape_ids[:n] == b)
+                offsets_a = get_offsets(*self.shapes[a])
+                offsets_b = get_offsets(*self.shapes[b])
+
+                rows = max(1, SPHERE_PAIRS_PER_CHUNK // (len(offsets_a) * len(offsets_b) * max(len(idx_b), 1)))
+                for k in range(0, len(idx_a), rows):
+                    block = idx_a[k:k + rows]
+                    pairs = np.ones((len(block), len(idx_b)), dtype=bool)
+                    if a == b:
+                        pairs = idx_b[None, :] > block[:, None]
+                    i, j = np.nonzero(pairs)
+                    i = block[i]
+                    j = idx_b[j]
+
+                    my_sum += np.sum(calc_sphere_dd_potential_arrays(
+                        self.positions[i], self.units[i], moments[i], offsets_a,
+                        self.positions[j], self.units[j], moments[j], offsets_b, factor))
+
+        return my_sum
+
+    def calc_dd_potentials(self, idx, others, factor, multiple_dipoles, unit=None):
+        """
+        Calculates the dipole-dipole potentials between one needle and several other needles at once.
+
+        :param idx: The id of the needle.
+        :param others: The ids of the other needles. (without idx)
+        :param factor: Prefactor of the potential [mue/(4*pi)]
+        :param multiple_dipoles: Turn to true if every sphere should be a dipole.
+        :param unit: Another direction of the needle idx. (None = its current direction)
+
+        :return: The potentials. (in the order of others)
+        """
+
+        n = len(self.needles)
+        moments = self.units[:n] * self.charges[:n, None]
+        if unit is None:
+            unit = self.units[idx]
+        else:
+            moments[idx] = unit * self.charges[idx]
+        others = np.asarray(others, dtype=int)
+
+        if not multiple_dipoles:
+            return calc_dd_potential_arrays(moments[idx], moments[others], self.positions[idx] - self.positions[others],
+                                            factor)
+
+        potentials = np.zeros(len(others))
+        offsets_1 = get_offsets(*self.shapes[self.shape_ids[idx]])
+        for s in np.unique(self.shape_ids[others]):
+            bucket = np.flatnonzero(self.shape_ids[others] == s)
+            offsets_2 = get_offsets(*self.shapes[s])
+
+            chunk = max(1, SPHERE_PAIRS_PER_CHUNK // (len(offsets_1) * len(offsets_2)))
+            for a in range(0, len(bucket), chunk):
+                rows = bucket[a:a + chunk]
+                block = others[rows]
+                potentials[rows] = calc_sphere_dd_potential_arrays(
+                    np.broadcast_to(self.positions[idx], (len(block), 3)),
+                    np.broadcast_to(unit, (len(block), 3)),
+                    np.broadcast_to(moments[idx], (len(block), 3)), offsets_1,
+                    self.positions[block], self.units[block], moments[block], offsets_2, factor)
+
+        return potentials
+
     def get_mean_magnetic_potential(self):
         """
         Gets the mean magnetic potential.\n
@@ -108,12 +283,8 @@ class Needles:
         :return: mean magnetic potential.
         """
 
-        my_sum = 0
-        for needle in self.needles:
-            x, y, z = needle.polar2cart(needle.charge)
-            my_sum += x
-
-        return my_sum / len(self.needles)
+        n = len(self.needles)
+        return np.sum(self.units[:n, 0] * self.charges[:n]) / n
 
     def get_coordinates(self):
         """
@@ -143,6 +314,8 @@ class Needles:
         :return: All sphere coordinates.
         """
 
+        self.update_coordinates()
+
         data_x = []
         data_y = []
         data_z = []
@@ -153,6 +326,124 @@ class Needles:
             data_z.append(needle.data_z)
         return data_x, data_y, data_z
 
+    def get_positions(self):
+        """
+        Gets the positions of the middle spheres of all needles.
+
+        :return: The positions. (array of shape N x 3)
+        """
+
+        return self.positions[:len(self.needles)].copy()
+
+    def get_orientations(self):
+        """
+        Gets the angles of all needles.
+
+        :return: The angles theta and phi. (two arrays of length N)
+        """
+
+        theta = np.array([needle.theta for needle in self.needles], dtype=float)
+        phi = np.array([needle.phi for needle in self.needles], dtype=float)
+
+        return theta, phi
+
+    def get_dipoles(self, multiple_dipoles):
+        """
+        Gets the positions and moments of all dipoles of the system.
+
+        :param multiple_dipoles: Turn to true if every sphere should be a dipole.
+
+        Returns:
+            - positions - The positions of the dipoles. (array of shape n x 3)
+            - moments - The moments of the dipoles. (array of shape n x 3)
+            - owners - The id of the needle of each dipole. (array of length n)
+        """
+
+        n = len(self.needles)
+        positions = self.get_positions()
+        charges = self.charges[:n]
+        units = self.units[:n]
+
+        if not multiple_dipoles:
+            return positions, units * charges[:, None], np.arange(n)
+
+        shapes = np.array(self.shapes).reshape(-1, 2)[self.shape_ids[:n]]
+        lengths = shapes[:, 0].astype(int)
+        radii = shapes[:, 1]
+
+        counts = 2 * lengths + 1
+        owners = np.repeat(np.arange(len(self.needles)), counts)
+        starts = np.cumsum(counts) - counts
+        k = np.arange(len(owners)) - starts[owners] - lengths[owners]   # -l ... l for every needle
+
+        sphere_positions = positions[owners] + (2 * radii[owners] * k)[:, None] * units[owners]
+
+        return sphere_positions, (units * charges[:, None])[owners], owners
+
+    def get_dipole_vector(self):
+        """
+        Gets the moments of all needles stacked into one vector (m1x, m1y, m1z, m2x, ...).
+
+        :return: The dipole vector. (array of length 3N)
+        """
+
+        _, moments, _ = self.get_dipoles(False)
+        return moments.ravel()
+
+    def set_orientation(self, idx, theta, phi):
+        """
+        Sets the angles of one needle and updates the stored sphere positions if needed.
+
+        :param idx: The id of the needle.
+        :param theta: The new angle theta in radians.
+        :param phi: The new angle phi in radians.
+        """
+
+        needle = self.needles[idx]
+        needle.theta = theta
+        needle.phi = phi
+        self.units[idx] = needle.polar2cart(1)
+
+        if self.p.cpu_improve:
+            data_x, data_y, data_z = needle.get_coordinate()
+            needle.data_x = data_x
+            needle.data_y = data_y
+            needle.data_z = data_z
+
+    def set_orientations(self, idx, theta, phi):
+        """
+        Sets the angles of several needles at once. The stored sphere positions are only rebuilt when they are
+        needed (update_coordinates).
+
+        :param idx: The ids of the needles.
+        :param theta: The new angles theta in radians.
+        :param phi: The new angles phi in radians.
+        """
+
+        self.units[idx] = polar2cart_arrays(theta, phi, 1)
+
+        for k in range(0, len(idx)):
+            needle = self.needles[idx[k]]
+            needle.theta = theta[k]
+            needle.phi = phi[k]
+
+        if self.p.cpu_improve:
+            self.outdated.update(int(i) for i in idx)
+
+    def update_coordinates(self):
+        """
+        Rebuilds the stored sphere positions of all needles which were changed by set_orientations.
+        """
+
+        for idx in self.outdated:
+            needle = self.needles[idx]
+            data_x, data_y, data_z = needle.get_coordinate()
+            needle.data_x = data_x
+            needle.data_y = data_y
+            needle.data_z = data_z
+
+        self.outdated = set()
+
     def plot_grid(self, use_for_gif=False):
         """
         Plots all needles in a 3D grid.
@@ -165,6 +456,13 @@ class Needles:
         else:
             data_x, data_y, data_z = self.get_coordinates()
 
+        # Needles of different shapes have a different number of spheres.
+        data_x = np.concatenate(data_x)
+        data_y = np.concatenate(data_y)
+        data_z = np.concatenate(data_z)
+
+        plt = get_pyplot()
+
         fig = plt.figure(figsize=(15, 10))  # control plot size
         ax = plt.axes(projection='3d')
         ax.set_xlim3d(0, self.p.box_dimensions[0])
@@ -178,11 +476,64 @@ class Needles:
         if use_for_gif:
             plt.savefig("./gif/picture_for_giv_" + str(use_for_gif) + ".png")
         else:
-            plt.show()
+            show(plt, "grid")
 
         plt.close(fig)
 
 
+def check_overlap_arrays(p1, u1, length, radius, p2, u2, shape_ids, shapes, hard_core_model):
+    """
+    Checks if one needle overlaps with other needles. (vectorised for every bucket)
+
+    :param p1: The position of the middle sphere of the needle.
+    :param u1: The direction of the needle.
+    :param length: The number of spheres to one side of the middle sphere of the needle.
+    :param radius: The radius of the spheres of the needle.
+    :param p2: The positions of the middle spheres of the other needles. (array of shape n x 3)
+    :param u2: The directions of the other needles. (array of shape n x 3)
+    :param shape_ids: The bucket of every other needle.
+    :param shapes: The shape (length, radius) of every bucket.
+    :param hard_core_model: "spheres" (chain of spheres) or "spherocylinder" (the hull of the chain).
+
+    :return: True if there is no overlap.
+    """
+
+    if len(shape_ids) == 0:
+        return True
+
+    if hard_core_model == "spherocylinder":
+        shapes_2 = np.array(shapes).reshape(-1, 2)[shape_ids]
+        distance = calc_segment_distances(p1, u1, 2 * radius * length, p2, u2, 2 * shapes_2[:, 1] * shapes_2[:, 0])
+        return not np.any(distance <= radius + shapes_2[:, 1])
+
+    spheres_1 = p1 + get_offsets(length, radius)[:, None] * u1
+
+    for s in np.unique(shape_ids):
+        bucket = shape_ids == s
+        length_2, radius_2 = shapes[s]
+
+        spheres_2 = p2[bucket][:, None, :] + get_offsets(length_2, radius_2)[None, :, None] * u2[bucket][:, None, :]
+        diff = spheres_1[None, :, None, :] - spheres_2[:, None, :, :]
+
+        if np.any(np.sum(diff * diff, axis=3) <= (radius + radius_2) ** 2):
+            return False
+
+    return True
+
+
+def get_offsets(length, radius):
+    """
+    Gets the offsets of all spheres of a needle from the middle sphere along its direction.
+
+    :param length: The number of spheres to one side of the middle sphere.
+    :param radius: The radius of the spheres.
+
+    :return: The offsets.
+    """
+
+    return 2 * radius * np.arange(-length, length + 1)
+
+
 def get_random_parameters():
     """
     Gets random parameters for a needle.
@@ -1,3 +1,6 @@
+import os
+import random
+
 import numpy as np
 
 
@@ -15,28 +18,93 @@ class Parameters:
         self.factor = 1                                 # Prefactor of the potential => mue/(4*pi)
         self.kT = 1                                     # k * Temperature
 
+        self.headless = False                           # Never uses a GUI backend, plots are saved to ./plots
+
         self.cpu_improve = True         # Stores all sphere positions fpr HS-Potential instead of recalculating them.
 
         self.multiple_dipoles = False                   # Turn to true if every sphere should be a dipole (buggy)
+        self.hard_core_model = "spheres"                # "spheres" (chain of spheres) or "spherocylinder"
+
+        self.domain_decomposition = False               # Turn to true to update separated cells in parallel
+        self.cutoff_radius = 2.5                        # Range of the dd-potential (domain decomposition)
+        self.dd_moves_per_needle = 1                    # The trial moves per needle of every cell in one sweep
+        self.processes = os.cpu_count()                 # The number of worker processes
+
+        self.use_interaction_tensor = False             # Precomputes the dd-coupling matrix (one dipole per needle)
+        self.tensor_memory_cap = 2 ** 30                # The memory for the stored dd-coupling matrix in bytes
+        self.store_configurations = False               # Stores every accepted configuration (dipole vector)
+
+        self.dipole_solver = "direct"                   # "direct" or "tree" (Barnes-Hut, for large open boxes)
+        self.tree_accuracy = 0.5                        # Opening angle of the tree (smaller is more accurate)
+        self.tree_leaf_size = 16                        # The maximum number of needles in one leaf of the tree
+
+        self.cluster_moves = False                      # Turn to true to also rotate clusters of linked needles
+        self.cluster_probability = 0.1                  # The probability that one step is a cluster step
+        self.cluster_max_angle = 0.2                    # The maximum angle of the rotation of a cluster in radians
+
+        self.audit_interval = 0                         # Recalculates the total energy every n steps (0 = off)
+        self.audit_resync = True                        # Replaces the tracked energies by the recalculated ones
 
         self.convergence_interval_length = 20           # The interval where it checks the standard deviation
         self.convergence_threshold = 0.05               # Convergence threshold in % (standard deviation / mean)
 
+        self.telemetry_retention = 10000                # The number of last energies which are kept exactly
+        self.telemetry_buckets = 2000                   # The number of buckets of the decimated energies (plots)
+
+        self.metrics_port = None                        # Serves live metrics on this local port (None = off)
+        self.metrics_interval = 100                     # The steps between two published metrics
+
+        self.production_steps = 0                       # The steps after convergence where samples are recorded
+        self.sample_interval = 10                       # The steps between two samples
+
         self.length = 2                                 # The length of the needles.
         self.width = 0.0892                             # The width of the needles.
         self.quantity = 15                              # The number of needles in the system.
 
-    def calculate_needle_dimensions(self):
+        # Polydisperse needles (either a histogram or distributions, None = all needles are equal)
+        self.needle_shapes = None                       # Histogram of the needle shapes: [(length, width, weight), ...]
+        self.length_distribution = None                 # Returns a random length, e.g. lambda: random.gauss(2, .2)
+        self.width_distribution = None                  # Returns a random width
+        self.width_resolution = 0.001                   # Widths are rounded to this to group equal needles
+
+    def calculate_needle_dimensions(self, length=None, width=None):
         """
         Calculates the dimension of one needle.
 
+        :param length: The length of the needle. (None = self.length)
+        :param width: The width of the needle. (None = self.width)
+
         Returns:
             - x - The number of spheres to one side of the middle sphere
             - r - The radius of the spheres
         """
 
-        tmp_l = int(((self.length / self.width) - 1) / 2)
-        return tmp_l, self.width / 2
+        length = self.length if length is None else length
+        width = self.width if width is None else width
+
+        tmp_l = max(int(((length / width) - 1) / 2), 0)
+        return tmp_l, width / 2
+
+    def sample_needle_dimensions(self):
+        """
+        Calculates the dimension of one random needle from self.needle_shapes or the distributions.
+
+        Returns:
+            - x - The number of spheres to one side of the middle sphere
+            - r - The radius of the spheres
+        """
+
+        if self.needle_shapes is not None:
+            weights = [shape[2] for shape in self.needle_shapes]
+            length, width, _ = random.choices(self.needle_shapes, weights)[0]
+        else:
+            length = self.length if self.length_distribution is None else self.length_distribution()
+            width = self.width if self.width_distribution is None else self.width_distribution()
+
+        if self.needle_shapes is not None or self.width_distribution is not None:
+            width = max(round(width / self.width_resolution), 1) * self.width_resolution
+
+        return self.calculate_needle_dimensions(length, width)
 
     def get_log_str(self):
         """
@@ -53,9 +121,13 @@ class Parameters:
         msg += "Width:\t\t{width}\n".format(width=self.width)
         msg += "Length:\t\t{length}\n".format(length=self.length)
         msg += "Quantity:\t{quantity}\n".format(quantity=self.quantity)
+        if self.needle_shapes is not None:
+            msg += "Shapes:\t\t{shapes}\n".format(shapes=self.needle_shapes)
         msg += "kT:\t\t{kt} \n\n".format(kt=self.kT)
         msg += "Target SD:\t\t{TSD}\n".format(TSD=self.convergence_threshold)
         msg += "Convergence Interval:\t{CI}\n".format(CI=self.convergence_interval_length)
+        if self.domain_decomposition:
+            msg += "Cutoff Radius:\t\t{cutoff}\n".format(cutoff=self.cutoff_radius)
         msg += "-------------------------------\n"
 
         return msg
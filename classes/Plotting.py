@@ -0,0 +1,58 @@
+import os
+
+# Info:
+# -----------------------------
+# Matplotlib is only imported when the first plot is made, so workers that only calculate do not load it.
+# In headless mode the non-GUI backend "Agg" is used and plots are saved to ./plots instead of shown.
+# -----------------------------
+
+_headless = False   # Turn to true to never use a GUI backend.
+_plot_nr = 0        # The number of plots saved in headless mode.
+
+
+def set_headless(headless):
+    """
+    Sets the headless mode.
+
+    :param headless: Turn to true to never use a GUI backend.
+    """
+
+    global _headless
+    _headless = headless
+
+
+def get_pyplot():
+    """
+    Imports matplotlib.pyplot. (with the "Agg" backend in headless mode)
+
+    :return: matplotlib.pyplot
+    """
+
+    import matplotlib
+
+    if _headless:
+        matplotlib.use("Agg")
+
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def show(plt, name):
+    """
+    Shows the current plot or saves it to ./plots/<nr>_<name>.png in headless mode.
+
+    :param plt: matplotlib.pyplot
+    :param name: The name of the plot.
+    """
+
+    global _plot_nr
+
+    if not _headless:
+        plt.show()
+        return
+
+    if not os.path.exists("./plots"):
+        os.makedirs("./plots")
+
+    _plot_nr += 1
+    plt.savefig("./plots/" + str(_plot_nr) + "_" + name + ".png")
@@ -0,0 +1,208 @@
+import numpy as np
+
+
+class Reweighting:
+
+    def __init__(self):
+        """
+        Class that predicts averages at other temperatures and fields from the samples of one or more simulations
+        (single histogram reweighting for one simulation, MBAR / binless WHAM for more).
+        The samples of a simulation are recorded after convergence (see p.production_steps).
+        Comment: samples should be taken far enough apart (p.sample_interval), otherwise the effective
+        sample sizes are too optimistic.
+        """
+
+        self.kT = []                # The kT of every simulation.
+        self.field_vector = []      # The field vector of every simulation.
+        self.n = []                 # The number of samples of every simulation.
+
+        self.dd_energy = np.zeros(0)            # The dipole-dipole potential of every sample.
+        self.moment = np.zeros((0, 3))          # The sum of all moments of every sample.
+        self.magnetization = np.zeros(0)        # The mean magnetic potential of every sample.
+        self.quantity = np.zeros(0)             # The number of needles of every sample.
+
+        self.f = np.zeros(0)        # The dimensionless free energy of every simulation.
+
+    def add_run(self, p, gv, discard=0.0):
+        """
+        Adds the samples of one simulation.
+
+        :param p: The parameters of the simulation. (class: Parameters)
+        :param gv: The global variables of the simulation. (class: GlobalValues)
+        :param discard: The fraction of the samples at the beginning which is not used.
+        """
+
+        start = int(len(gv.sample_dd_energy) * discard)
+
+        dd_energy = np.asarray(gv.sample_dd_energy[start:], dtype=float)
+        moment = np.asarray(gv.sample_moment[start:], dtype=float).reshape(-1, 3)
+        magnetization = np.asarray(gv.sample_magnetization[start:], dtype=float)
+
+        if len(dd_energy) == 0:
+            print("Error: The simulation has no samples (p.production_steps)")
+            return
+
+        self.kT.append(p.kT)
+        self.field_vector.append(np.asarray(p.field_vector, dtype=float))
+        self.n.append(len(dd_energy))
+
+        self.dd_energy = np.concatenate([self.dd_energy, dd_energy])
+        self.moment = np.concatenate([self.moment, moment])
+        self.magnetization = np.concatenate([self.magnetization, magnetization])
+        self.quantity = np.concatenate([self.quantity, np.full(len(dd_energy), p.quantity, dtype=float)])
+
+        self.solve()
+
+    def get_reduced_potential(self, kT, field_vector):
+        """
+        Gets the reduced potential (total energy / kT) of every sample at another temperature and field.
+
+        :param kT: k * Temperature
+        :param field_vector: The vector of the field.
+
+        :return: The reduced potentials.
+        """
+
+        return (self.dd_energy + self.moment @ np.asarray(field_vector, dtype=float)) / kT
+
+    def solve(self, tolerance=1e-10, max_iterations=10000):
+        """
+        Solves the MBAR equations for the free energies of all simulations (self-consistent iteration).
+
+        :param tolerance: The maximum change of the free energies when the iteration stops.
+        :param max_iterations: The maximum number of iterations.
+        """
+
+        u = np.array([self.get_reduced_potential(kT, f) for kT, f in zip(self.kT, self.field_vector)])
+        log_n = np.log(np.array(self.n, dtype=float))
+
+        f = np.zeros(len(self.n))
+        f[:len(self.f)] = self.f
+
+        for _ in range(max_iterations):
+            log_denominator = logsumexp(log_n[:, None] + f[:, None] - u, axis=0)
+            f_new = -logsumexp(-u - log_denominator[None, :], axis=1)
+            f_new -= f_new[0]
+
+            if np.max(np.abs(f_new - f)) < tolerance:
+                f = f_new
+                break
+            f = f_new
+
+        self.f = f
+
+    def get_log_denominator(self):
+        """
+        Gets log(sum_k N_k exp(f_k - u_k)) for every sample, the weight of each sample in the pooled simulations.
+
+        :return: The log denominators.
+        """
+
+        u = np.array([self.get_reduced_potential(kT, f) for kT, f in zip(self.kT, self.field_vector)])
+        log_n = np.log(np.array(self.n, dtype=float))
+
+        return logsumexp(log_n[:, None] + self.f[:, None] - u, axis=0)
+
+    def get_weights(self, kT, field_vector):
+        """
+        Gets the normalised weights of all samples at another temperature and field.
+
+        :param kT: k * Temperature
+        :param field_vector: The vector of the field.
+
+        :return: The weights.
+        """
+
+        log_w = -self.get_reduced_potential(kT, field_vector) - self.get_log_denominator()
+        return np.exp(log_w - logsumexp(log_w))
+
+    def get_average(self, values, kT, field_vector):
+        """
+        Predicts the average of an observable at another temperature and field.
+
+        :param values: The observable of every sample (e.g. self.magnetization or self.dd_energy).
+        :param kT: k * Temperature
+        :param field_vector: The vector of the field.
+
+        Returns:
+            - mean - The predicted average.
+            - n_eff - The effective number of samples (1 / sum(w^2)). Few effective samples mean that the
+                      target is not covered by the simulations and the prediction is not reliable.
+        """
+
+        w = self.get_weights(kT, field_vector)
+        return np.sum(w * values), 1 / np.sum(w * w)
+
+    def get_magnetization_curve(self, kT, field_strengths, direction):
+        """
+        Predicts the mean magnetic potential along the field for several field strengths.
+
+        :param kT: k * Temperature
+        :param field_strengths: The field strengths.
+        :param direction: The direction of the field.
+
+        Returns:
+            - mean - The predicted mean magnetic potential along the direction for every field strength.
+            - n_eff - The effective number of samples for every field strength.
+        """
+
+        direction = np.asarray(direction, dtype=float)
+        direction = direction / np.linalg.norm(direction)
+
+        # The mean moment of one needle along the field. (self.magnetization is only the x component)
+        magnetization = self.moment @ direction / self.quantity
+
+        mean = []
+        n_eff = []
+        for strength in field_strengths:
+            m, n = self.get_average(magnetization, kT, strength * direction)
+            mean.append(m)
+            n_eff.append(n)
+
+        return np.array(mean), np.array(n_eff)
+
+    def get_overlap_matrix(self):
+        """
+        Gets the overlap matrix of the simulations (MBAR). Entry (k, l) is the probability that a sample of
+        simulation k could also be a sample of simulation l. The second largest eigenvalue close to 1 means that
+        the simulations do not overlap and the free energies are not reliable.
+
+        :return: The overlap matrix.
+        """
+
+        u = np.array([self.get_reduced_potential(kT, f) for kT, f in zip(self.kT, self.field_vector)])
+        w = np.exp(self.f[:, None] - u - self.get_log_denominator()[None, :])
+
+        return (w @ w.T) * np.array(self.n, dtype=float)[None, :]
+
+    def get_log_str(self):
+        """
+        Creates a log-string with all simulations.
+
+        :returns: log-sting.
+        """
+
+        msg = "\nReweighting Log\n"
+        msg += "-------------------------------\n"
+        for k in range(len(self.n)):
+            msg += "kT: {kt}\tField: {field}\tSamples: {n}\tf: {f}\n".format(kt=self.kT[k], field=self.field_vector[k],
+                                                                            n=self.n[k], f=self.f[k])
+        msg += "-------------------------------\n"
+
+        return msg
+
+
+def logsumexp(a, axis=None):
+    """
+    Calculates log(sum(exp(a))) without overflow.
+
+    :param a: The array.
+    :param axis: The axis of the sum.
+
+    :return: log(sum(exp(a)))
+    """
+
+    a_max = np.max(a, axis=axis, keepdims=True)
+    result = np.log(np.sum(np.exp(a - a_max), axis=axis, keepdims=True)) + a_max
+
+    return np.squeeze(result, axis=axis) if axis is not None else result.item()
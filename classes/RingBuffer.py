@@ -0,0 +1,120 @@
+import math
+
+import numpy as np
+
+
+class RingBuffer:
+
+    def __init__(self, retention, buckets):
+        """
+        Class that stores a series of values with bounded memory.
+        The last values are kept exactly in a ring. The whole series is kept decimated in buckets
+        (min, max and mean per bucket). When all buckets are full, neighbouring buckets are merged and
+        every bucket covers twice as many values as before.
+
+        :param retention: The number of values which are kept exactly.
+        :param buckets: The maximum number of buckets of the decimated series. (rounded up to an even number)
+        """
+
+        self.retention = max(int(retention), 1)
+        self.buckets = max(int(buckets) + int(buckets) % 2, 2)
+
+        self.values = np.zeros(self.retention)  # The last values (ring).
+        self.count = 0                          # The number of values appended so far.
+
+        self.width = 1                                      # The number of values per bucket.
+        self.bucket_min = np.full(self.buckets, math.inf)   # The minimum of every bucket.
+        self.bucket_max = np.full(self.buckets, -math.inf)  # The maximum of every bucket.
+        self.bucket_sum = np.zeros(self.buckets)            # The sum of every bucket.
+        self.bucket_count = np.zeros(self.buckets)          # The number of values of every bucket.
+
+    def __len__(self):
+        """
+        Gets the number of values appended so far.
+
+        :return: The number of values.
+        """
+
+        return self.count
+
+    def append(self, x):
+        """
+        Appends one value.
+
+        :param x: The value to be added.
+        """
+
+        self.values[self.count % self.retention] = x
+
+        k = self.count // self.width
+        if k >= self.buckets:
+            self.merge_buckets()
+            k = self.count // self.width
+
+        if x < self.bucket_min[k]:
+            self.bucket_min[k] = x
+        if x > self.bucket_max[k]:
+            self.bucket_max[k] = x
+        self.bucket_sum[k] += x
+        self.bucket_count[k] += 1
+
+        self.count += 1
+
+    def merge_buckets(self):
+        """
+        Merges every two neighbouring buckets and doubles the width of the buckets.
+        """
+
+        half = self.buckets // 2
+
+        self.bucket_min[:half] = np.minimum(self.bucket_min[0::2], self.bucket_min[1::2])
+        self.bucket_max[:half] = np.maximum(self.bucket_max[0::2], self.bucket_max[1::2])
+        self.bucket_sum[:half] = self.bucket_sum[0::2] + self.bucket_sum[1::2]
+        self.bucket_count[:half] = self.bucket_count[0::2] + self.bucket_count[1::2]
+
+        self.bucket_min[half:] = math.inf
+        self.bucket_max[half:] = -math.inf
+        self.bucket_sum[half:] = 0
+        self.bucket_count[half:] = 0
+
+        self.width *= 2
+
+    def get_latest(self):
+        """
+        Gets the last value.
+
+        :return: The last value.
+        """
+
+        return self.values[(self.count - 1) % self.retention]
+
+    def get_last(self, n):
+        """
+        Gets the last values in order. (at most the retention)
+
+        :param n: The number of values.
+
+        :return: The last values.
+        """
+
+        n = min(n, self.count, self.retention)
+        idx = np.arange(self.count - n, self.count) % self.retention
+
+        return self.values[idx]
+
+    def get_decimated(self):
+        """
+        Gets the decimated series of all values appended so far.
+
+        Returns:
+            - index - The index of the first value of every bucket.
+            - min - The minimum of every bucket.
+            - max - The maximum of every bucket.
+            - mean - The mean of every bucket.
+        """
+
+        n = math.ceil(self.count / self.width)
+        index = np.arange(n) * self.width
+
+        return (index, self.bucket_min[:n].copy(), self.bucket_max[:n].copy(),
+                self.bucket_sum[:n] / self.bucket_count[:n])
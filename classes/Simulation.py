@@ -1,11 +1,16 @@
 from classes.Needle import Needle
 from classes.Needles import Needles
+from classes.DomainDecomposition import DomainDecomposition, get_unsupported_parameters
+from classes.EnergyAudit import EnergyAudit
+from classes.InteractionTensor import InteractionTensor
+from classes.DipoleTree import DipoleTree
+from classes.Plotting import set_headless
 
 import random
 import numpy as np
 import os
-import imageio.v2 as imageio
 import shutil
+import time
 
 
 class Simulation:
@@ -20,10 +25,45 @@ class Simulation:
 
         self.p = p
         self.gv = gv
+
+        set_headless(p.headless)
+
+        if p.domain_decomposition:
+            for name in get_unsupported_parameters(p):
+                print("Error: p.{name} is ignored in domain decomposition mode".format(name=name))
+
         self.needles = Needles(p)
 
-        gv.E_tot = self.needles.calc_total_energy(self.gv, self.p.field_vector, self.p.factor, self.p.multiple_dipoles,
-                                                  self.p.cpu_improve)
+        self.tensor = None          # The precomputed dipole-dipole coupling matrix.
+        if p.use_interaction_tensor and not p.multiple_dipoles and not p.domain_decomposition:
+            self.tensor = InteractionTensor(self.needles.get_positions(), p.tensor_memory_cap)
+
+        self.tree = None            # The Barnes-Hut tree for the dipole-dipole potential.
+        if p.dipole_solver == "tree" and self.tensor is not None:
+            print("Error: p.dipole_solver is ignored with p.use_interaction_tensor")
+        elif p.dipole_solver == "tree" and not p.domain_decomposition:
+            self.tree = DipoleTree(self.needles, p)
+
+        self.decomposition = None   # Splits the box into cells which are updated in parallel.
+        if p.domain_decomposition:
+            self.decomposition = DomainDecomposition(self.needles, p)
+            gv.E_tot = self.decomposition.calc_total_energy(self.gv)
+        else:
+            gv.E_tot = self.needles.calc_total_energy(self.gv, self.p.field_vector, self.p.factor,
+                                                      self.p.multiple_dipoles, self.p.cpu_improve, self.tensor,
+                                                      self.tree)
+
+        self.audit = None           # Recalculates the total energy to check the tracked one for drift.
+        if p.audit_interval > 0:
+            self.audit = EnergyAudit(p)
+
+        self.attempted = {"single": 0, "cluster": 0, "sweep": 0}    # The number of attempted steps of every kind.
+                                                                    # (trial moves of single needles for sweeps)
+        self.accepted = {"single": 0, "cluster": 0, "sweep": 0}     # The number of accepted steps of every kind.
+
+        self.metrics = None         # Serves the current metrics on a local port.
+        self.metrics_time = 0       # The time of the last published metrics.
+        self.metrics_step = 0       # The step of the last published metrics.
 
     def simulate(self, telegram, use_for_gif=False):
         """
@@ -37,6 +77,15 @@ class Simulation:
             if not os.path.exists("./gif"):
                 os.makedirs("./gif")
 
+        if self.decomposition is not None:
+            self.decomposition.start()
+
+        if self.p.metrics_port is not None:
+            from classes.MetricsServer import MetricsServer  # Only needed for live metrics (http.server).
+
+            self.metrics = MetricsServer(self.p.metrics_port)
+            self.metrics.start()
+
         i = 0
         self.gv.start_timer()
         while True:
@@ -46,9 +95,18 @@ class Simulation:
                 self.gv.append_energies()
                 self.gv.add_step(i + 1)
 
+                if self.p.store_configurations:
+                    self.gv.append_configuration(self.needles.get_dipole_vector())
+
                 if use_for_gif:
                     self.needles.plot_grid(i+1)
 
+            if self.audit is not None and (i + 1) % self.p.audit_interval == 0:
+                self.audit.run(self.needles, self.gv, i + 1, self.tree)
+
+            if self.metrics is not None and (i + 1) % self.p.metrics_interval == 0:
+                self.publish_metrics(i + 1)
+
             # Check convergence
             self.gv.add_ci_step()
             self.gv.append_mean_magnetic_potential_x(self.needles.get_mean_magnetic_potential())
@@ -75,16 +133,124 @@ class Simulation:
 
             i += 1
 
+        if self.p.production_steps > 0:
+            self.sample(i + 1)
+
+        if self.decomposition is not None:
+            self.decomposition.close()
+
+        if self.audit is not None:
+            self.audit.close()
+
+        if self.metrics is not None:
+            self.metrics.stop()
+            self.metrics = None
+
         if use_for_gif:
             self.gif()
 
+    def sample(self, i):
+        """
+        Simulates p.production_steps more steps after convergence and records a sample every p.sample_interval
+        steps. (used for class Reweighting)
+
+        :param i: The last step of the simulation.
+        """
+
+        for k in range(0, self.p.production_steps):
+            if self.next_step():
+                self.gv.append_energies()
+                self.gv.add_step(i + k + 1)
+
+            if (k + 1) % self.p.sample_interval == 0:
+                _, moments, _ = self.needles.get_dipoles(False)
+                self.gv.append_sample(np.sum(moments, axis=0), self.needles.get_mean_magnetic_potential())
+
+            if self.metrics is not None and (i + k + 1) % self.p.metrics_interval == 0:
+                self.publish_metrics(i + k + 1, True)
+
+    def publish_metrics(self, i, converged=False):
+        """
+        Publishes the current metrics to the metrics server.
+
+        :param i: The current step.
+        :param converged: True if the system already converged.
+        """
+
+        t = time.time()
+        steps_per_second = (i - self.metrics_step) / (t - self.metrics_time) if self.metrics_step > 0 else 0
+        self.metrics_time = t
+        self.metrics_step = i
+
+        # At most 200 points of the decimated total energies.
+        _, _, _, energies = self.gv.total_energy_array.get_decimated()
+        _, steps, _, _ = self.gv.steps_array.get_decimated()
+        stride = max(1, len(energies) // 200)
+
+        snapshot = {
+            "step": i,
+            "steps_per_second": steps_per_second,
+            "converged": converged,
+            "total_energy": float(self.gv.E_tot),
+            "dd_energy": float(self.gv.E_DD),
+            "field_energy": float(self.gv.E_F),
+            "ci_stddev_norm": float(self.gv.ci_stddev_norm),
+            "ci_mean": float(self.gv.ci_mean),
+            "energy_series_steps": steps[::stride].tolist(),
+            "energy_series": energies[::stride].tolist(),
+        }
+
+        for kind in self.attempted:
+            if self.attempted[kind] > 0:
+                snapshot["acceptance_rate_" + kind] = self.accepted[kind] / self.attempted[kind]
+
+        self.metrics.publish(snapshot)
+
+    def count_step(self, kind, accepted):
+        """
+        Counts one attempted step for the acceptance rates.
+
+        :param kind: The kind of the step. ("single" or "cluster")
+        :param accepted: True if the step was accepted.
+
+        :return: accepted
+        """
+
+        self.attempted[kind] += 1
+        if accepted:
+            self.accepted[kind] += 1
+
+        return accepted
+
     def next_step(self):
         """
-        Performs one step during the simulations.
+        Performs one step during the simulations. (one sweep in domain decomposition mode)
+
+        :return: True if a new state was accepted.
+        """
+
+        if self.decomposition is not None:
+            changed = self.decomposition.sweep(self.gv)
+
+            # The acceptance rate of the single moves inside the sweep.
+            self.attempted["sweep"] += self.decomposition.attempted
+            self.accepted["sweep"] += self.decomposition.accepted
+            return changed
+
+        if self.p.cluster_moves and random.random() < self.p.cluster_probability:
+            return self.count_step("cluster", self.next_cluster_step())
+
+        return self.count_step("single", self.next_single_step())
+
+    def next_single_step(self):
+        """
+        Performs one step with one random needle.
+
+        :return: True if the new angle was accepted.
         """
 
         index = random.randint(0, len(self.needles.get()) - 1)
-        old_needle = self.needles.get().pop(index)
+        old_needle = self.needles.get_by_id(index)
 
         x = old_needle.pos_x
         y = old_needle.pos_y
@@ -103,14 +269,30 @@ class Simulation:
             new_needle.data_y = data_y
             new_needle.data_z = data_z
 
-        if not new_needle.check_overlap(self.needles.get(), self.p.cpu_improve):
-            self.needles.append(old_needle)
+        # The needle is replaced at its index, so the order of the needles (and of self.tensor) stays the same.
+        if not self.needles.check_overlap(new_needle, index):
             return False
         else:
-            self.needles.append(new_needle)
-
-        e_tot_new = self.needles.calc_total_energy(self.gv, self.p.field_vector, self.p.factor, self.p.multiple_dipoles,
-                                                   self.p.cpu_improve)
+            self.needles.replace(index, new_needle)
+
+        e_dd = self.gv.E_DD
+        e_f = self.gv.E_F
+        d_m = np.array(new_needle.polar2cart(charge)) - np.array(old_needle.polar2cart(charge))
+        if self.tensor is not None:
+            # Only the three rows of the coupling matrix which belong to the moved needle are needed.
+            self.gv.E_DD += self.p.factor * d_m @ self.tensor.calc_local_field(index, self.needles.get_dipole_vector())
+        elif self.tree is not None:
+            # Only the potential of the moved needle is traversed. (the whole tree only for the start and the audit)
+            e_needle = self.tree.calc_dd_potential(index, self.p.factor)
+            self.tree.update(index, theta, phi)
+            self.gv.E_DD += self.tree.calc_dd_potential(index, self.p.factor) - e_needle
+
+        if self.tensor is not None or self.tree is not None:
+            self.gv.E_F += d_m @ np.asarray(self.p.field_vector, dtype=float)
+            e_tot_new = self.gv.E_DD + self.gv.E_F
+        else:
+            e_tot_new = self.needles.calc_total_energy(self.gv, self.p.field_vector, self.p.factor,
+                                                       self.p.multiple_dipoles, self.p.cpu_improve)
 
         if e_tot_new < self.gv.E_tot:
             self.gv.E_tot = e_tot_new
@@ -123,17 +305,140 @@ class Simulation:
 
             return True
         else:
-            self.needles.get().pop(len(self.needles.get()) - 1)
-            self.needles.append(old_needle)
+            self.needles.replace(index, old_needle)
+            if self.tree is not None:
+                self.tree.update(index, old_needle.theta, old_needle.phi)
+            self.gv.E_DD = e_dd
+            self.gv.E_F = e_f
             return False
 
+    def next_cluster_step(self):
+        """
+        Performs one cluster step (after the virtual move Monte Carlo). First a random rotation R (at most
+        p.cluster_max_angle) is chosen. Starting from a random needle i, every other needle j is linked to the cluster
+        with the probability 1 - exp(-w / kT), where w is the increase of their dipole-dipole potential if only i were
+        rotated plus their attraction (see get_link_weights). Then all needles of the cluster are rotated by R about
+        their fixed middle spheres. The rotation is accepted with the probability
+        min(1, exp(-dE / kT) * P_reverse / P_forward), where P_forward and P_reverse are the probabilities of all link
+        decisions of this rotation and of the rotation back. (for attracting needles at the border of the cluster
+        this cancels their change of the dipole-dipole potential)
+
+        :return: True if the rotation was accepted.
+        """
+
+        needles = self.needles.get()
+        n = len(needles)
+        kT = self.p.kT
+        rotation = get_random_rotation(self.p.cluster_max_angle)
+
+        seed = random.randint(0, n - 1)
+        in_cluster = np.zeros(n, dtype=bool)
+        in_cluster[seed] = True
+        stack = [seed]
+        decisions = []      # Every needle of the cluster with the tested needles, the weights and the links.
+
+        while stack:
+            i = stack.pop()
+
+            outside = np.flatnonzero(~in_cluster)
+            u_dd = self.needles.calc_dd_potentials(i, outside, self.p.factor, self.p.multiple_dipoles)
+            u_moved = self.needles.calc_dd_potentials(i, outside, self.p.factor, self.p.multiple_dipoles,
+                                                      rotation @ self.needles.units[i])
+            weight = get_link_weights(u_dd, u_moved)
+            linked = np.random.random(len(outside)) < -np.expm1(-weight / kT)
+
+            in_cluster[outside[linked]] = True
+            stack.extend(outside[linked])
+            decisions.append((i, outside, u_dd, weight, linked))
+
+        cluster = np.flatnonzero(in_cluster)
+        theta_old = np.array([needles[i].theta for i in cluster], dtype=float)
+        phi_old = np.array([needles[i].phi for i in cluster], dtype=float)
+        units_old = self.needles.units[cluster].copy()
+        e_inside_old = self.calc_cluster_dd_energy(cluster)
+
+        units = units_old @ rotation.T
+        self.needles.set_orientations(cluster, np.arccos(np.clip(units[:, 2], -1, 1)),
+                                      np.arctan2(units[:, 1], units[:, 0]) % (2 * np.pi))
+
+        # Hard-sphere potential
+        if not all(self.needles.check_overlap(needles[i], i) for i in cluster):
+            self.needles.set_orientations(cluster, theta_old, phi_old)
+            return False
+
+        # The link decisions of the rotation back (R^-1 from the new state) and the potentials across the border.
+        log_ratio = 0
+        d_dd = 0
+        for i, outside, u_dd, weight, linked in decisions:
+            k = np.searchsorted(cluster, i)     # The index of i in the cluster.
+            u_new = self.needles.calc_dd_potentials(i, outside, self.p.factor, self.p.multiple_dipoles)
+            u_back = self.needles.calc_dd_potentials(i, outside, self.p.factor, self.p.multiple_dipoles,
+                                                     units_old[k])
+            weight_back = get_link_weights(u_new, u_back)
+
+            if np.any(weight_back[linked] <= 0):  # The link can not be formed back, so there is no reverse step.
+                self.needles.set_orientations(cluster, theta_old, phi_old)
+                return False
+
+            log_ratio += np.sum(np.log(np.expm1(-weight_back[linked] / kT) / np.expm1(-weight[linked] / kT)))
+            log_ratio += np.sum(weight[~linked] - weight_back[~linked]) / kT
+
+            border = ~in_cluster[outside]
+            d_dd += np.sum(u_new[border] - u_dd[border])
+
+        d_dd += self.calc_cluster_dd_energy(cluster) - e_inside_old
+        d_f = np.sum((self.needles.units[cluster] - units_old) * self.needles.charges[cluster, None]
+                     @ np.asarray(self.p.field_vector, dtype=float))
+
+        if self.tree is not None:
+            # The tracked energy is the approximation of the tree: the needles are rotated one after another.
+            d_dd = 0
+            for k in range(0, len(cluster)):
+                e_needle = self.tree.calc_dd_potential(cluster[k], self.p.factor)
+                self.tree.update(cluster[k], needles[cluster[k]].theta, needles[cluster[k]].phi)
+                d_dd += self.tree.calc_dd_potential(cluster[k], self.p.factor) - e_needle
+
+        if np.log(random.random()) >= log_ratio - (d_dd + d_f) / kT:
+            self.needles.set_orientations(cluster, theta_old, phi_old)
+            if self.tree is not None:
+                for k in range(0, len(cluster)):
+                    self.tree.update(cluster[k], theta_old[k], phi_old[k])
+            return False
+
+        self.gv.E_DD += d_dd
+        self.gv.E_F += d_f
+        self.gv.E_tot = self.gv.E_DD + self.gv.E_F
+
+        return True
+
+    def calc_cluster_dd_energy(self, cluster):
+        """
+        Calculates the dipole-dipole potential between the needles of a cluster.
+
+        :param cluster: The ids of the needles of the cluster.
+
+        :return: The dipole-dipole potential inside the cluster.
+        """
+
+        my_sum = 0
+        for k in range(0, len(cluster) - 1):
+            my_sum += np.sum(self.needles.calc_dd_potentials(cluster[k], cluster[k + 1:], self.p.factor,
+                                                             self.p.multiple_dipoles))
+
+        return my_sum
+
     def gif(self):
         """
         Generates a gif of the simulations over time and saves it as simulation.gif.
         """
 
+        import imageio.v2 as imageio  # Only needed for the gif.
+
+        # The steps are read from the file names, the steps array only keeps the last steps.
+        steps = sorted(int(name[len("picture_for_giv_"):-len(".png")]) for name in os.listdir("./gif"))
+
         images = list()
-        for i in self.gv.steps_array:
+        for i in steps:
             images.append(imageio.imread("gif/picture_for_giv_" + str(i) + ".png"))
         imageio.mimsave("simulation.gif", images)
 
@@ -149,3 +454,36 @@ def get_random_parameters():
     cos_theta = 2 * np.random.random() - 1
 
     return np.arccos(cos_theta), phi
+
+
+def get_random_rotation(max_angle):
+    """
+    Generates a random rotation about a uniformly distributed axis by an angle in [-max_angle, max_angle].
+    (the inverse rotation has the same probability)
+
+    :param max_angle: The maximum angle in radians.
+
+    :return: The rotation matrix.
+    """
+
+    axis = np.random.normal(size=3)
+    axis /= np.linalg.norm(axis)
+    angle = (2 * np.random.random() - 1) * max_angle
+
+    k = np.array([[0, -axis[2], axis[1]], [axis[2], 0, -axis[0]], [-axis[1], axis[0], 0]])
+    return np.eye(3) + np.sin(angle) * k + (1 - np.cos(angle)) * (k @ k)
+
+
+def get_link_weights(u_dd, u_moved):
+    """
+    Calculates the weights w of the links between a needle and other needles, which are linked with the probability
+    1 - exp(-w / kT). A needle is linked if the rotation of the needle alone would increase their dipole-dipole
+    potential or if they attract each other.
+
+    :param u_dd: The dipole-dipole potentials with the other needles.
+    :param u_moved: The dipole-dipole potentials with the other needles if only the needle is rotated.
+
+    :return: The weights of the links.
+    """
+
+    return np.maximum(u_moved - u_dd, 0) + np.maximum(-u_dd, 0)
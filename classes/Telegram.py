@@ -1,6 +1,3 @@
-import requests
-
-
 class Telegram:
 
     chat_id = ""    # Add Chat ID here
@@ -37,6 +34,8 @@ class Telegram:
         Sends the message via Telegram.
         """
 
+        import requests  # Only needed when a message is sent.
+
         first_part = "https://api.telegram.org/" + self.token + "/sendMessage?chat_id="
         second_part = "&text="
         requests.get(first_part + self.chat_id + second_part + self.message)
@@ -3,17 +3,19 @@ from classes.GlobalValues import GlobalValues
 from classes.Telegram import Telegram
 from classes.Simulation import Simulation
 
-start_p = Parameters()
-# tele = Telegram()
-tele = False
+if __name__ == "__main__":  # Needed for the worker processes of the domain decomposition.
+    start_p = Parameters()
+    # tele = Telegram()
+    tele = False
 
-my_sim = Simulation(start_p, GlobalValues(start_p.convergence_interval_length))
+    my_sim = Simulation(start_p, GlobalValues(start_p.convergence_interval_length, start_p.telemetry_retention,
+                                              start_p.telemetry_buckets))
 
-my_sim.needles.plot_grid()
-my_sim.simulate(tele)
-my_sim.needles.plot_grid()
+    my_sim.needles.plot_grid()
+    my_sim.simulate(tele)
+    my_sim.needles.plot_grid()
 
-my_sim.gv.plot_total_energy()
-my_sim.gv.plot_dd_energy()
-my_sim.gv.plot_field_energy()
-my_sim.gv.plot_mean_magnetic_potential()
+    my_sim.gv.plot_total_energy()
+    my_sim.gv.plot_dd_energy()
+    my_sim.gv.plot_field_energy()
+    my_sim.gv.plot_mean_magnetic_potential()
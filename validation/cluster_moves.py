@@ -0,0 +1,128 @@
+import contextlib
+import io
+import random
+
+import numpy as np
+
+from classes.Parameters import Parameters
+from classes.GlobalValues import GlobalValues
+from classes.Simulation import Simulation
+
+# Info:
+# -----------------------------
+# 1. Samples a small system once only with single needle steps and once with half of the steps as cluster steps.
+#    Both have to give the same averages, otherwise the acceptance rule of the cluster steps is wrong.
+#    (only cluster steps mix badly, because strongly attracting needles are almost always rotated together)
+# 2. Measures the acceptance and the size of accepted cluster steps for field-aligned needles in strong fields.
+# Run from the main directory: python -m validation.cluster_moves
+# -----------------------------
+
+
+def get_simulation(p, seed=0):
+    """
+    Places the needles and calculates the energy of the start. (without the output of every placed needle)
+
+    :param p: The parameters of the system. (class: Parameters)
+    :param seed: The seed of the random number generators.
+
+    :return: The simulation. (class: Simulation)
+    """
+
+    random.seed(seed)
+    np.random.seed(seed)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        return Simulation(p, GlobalValues(p.convergence_interval_length))
+
+
+def sample(sim, steps, batches=20):
+    """
+    Performs steps and records the dipole-dipole potential and the mean magnetic potential after every step.
+
+    :param sim: The simulation. (class: Simulation)
+    :param steps: The number of steps.
+    :param batches: The number of batches for the standard errors.
+
+    Returns:
+        - mean - The means of the dipole-dipole and the mean magnetic potential.
+        - error - The standard errors of the means. (batch means)
+    """
+
+    values = np.zeros((steps, 2))
+    for k in range(0, steps):
+        sim.next_step()
+        values[k] = sim.gv.E_DD, sim.needles.get_mean_magnetic_potential()
+
+    means = values[:steps - steps % batches].reshape(batches, -1, 2).mean(axis=1)
+    return values.mean(axis=0), means.std(axis=0, ddof=1) / np.sqrt(batches)
+
+
+def align(sim):
+    """
+    Turns every needle against the field if it does not overlap, then recalculates the energy.
+
+    :param sim: The simulation. (class: Simulation)
+    """
+
+    field = np.asarray(sim.p.field_vector, dtype=float)
+    u = -field / np.linalg.norm(field)
+    theta = np.arccos(u[2])
+    phi = np.arctan2(u[1], u[0]) % (2 * np.pi)
+
+    for i, needle in enumerate(sim.needles.get()):
+        old_theta, old_phi = needle.theta, needle.phi
+        sim.needles.set_orientations(np.array([i]), np.array([theta]), np.array([phi]))
+        if not sim.needles.check_overlap(needle, i):
+            sim.needles.set_orientations(np.array([i]), np.array([old_theta]), np.array([old_phi]))
+
+    sim.gv.E_tot = sim.needles.calc_total_energy(sim.gv, sim.p.field_vector, sim.p.factor, sim.p.multiple_dipoles,
+                                                 sim.p.cpu_improve)
+
+
+if __name__ == "__main__":
+    print("\nCluster Steps Validation")
+    print("-------------------------------")
+
+    results = []
+    for cluster_probability in (0, 0.5):
+        p = Parameters()
+        p.quantity = 4
+        p.box_dimensions = np.array([2.5, 2.5, 2.5])
+        p.field_vector = np.array([1, 0, 0])
+        p.cluster_moves = cluster_probability > 0
+        p.cluster_probability = cluster_probability
+        p.cluster_max_angle = np.pi
+
+        sim = get_simulation(p)
+        results.append(sample(sim, 20000))
+        print("Cluster probability {c}:\tE_DD = {e:.4f} +- {de:.4f}, m_x = {m:.4f} +- {dm:.4f}".format(
+            c=cluster_probability, e=results[-1][0][0], de=results[-1][1][0], m=results[-1][0][1],
+            dm=results[-1][1][1]))
+
+    (mean_single, error_single), (mean_cluster, error_cluster) = results
+    if np.any(np.abs(mean_single - mean_cluster) > 4 * np.sqrt(error_single ** 2 + error_cluster ** 2)):
+        print("Error: The cluster steps do not sample the same distribution as the single needle steps")
+
+    print("-------------------------------")
+
+    for strength, max_angle in ((20, 0.1), (200, 0.05), (2000, 0.02)):
+        p = Parameters()
+        p.quantity = 30
+        p.field_vector = np.array([strength, 0, 0])
+        p.cluster_moves = True
+        p.cluster_probability = 1
+        p.cluster_max_angle = max_angle
+
+        sim = get_simulation(p)
+        align(sim)
+        rotated = 0
+        for _ in range(0, 500):
+            units = sim.needles.units.copy()
+            sim.next_step()
+            rotated += np.count_nonzero(np.any(sim.needles.units != units, axis=1))
+
+        accepted = sim.accepted["cluster"]
+        print("|B| = {b}, max angle {a}:\taccepted {acc} of {att} cluster steps, {s:.1f} needles per cluster".format(
+            b=strength, a=max_angle, acc=accepted, att=sim.attempted["cluster"], s=rotated / max(accepted, 1)))
+
+    print("-------------------------------")
@@ -0,0 +1,123 @@
+import contextlib
+import io
+import random
+
+import numpy as np
+
+from classes.Parameters import Parameters
+from classes.GlobalValues import GlobalValues
+from classes.Needles import Needles
+from classes.DipoleTree import DipoleTree
+
+# Info:
+# -----------------------------
+# Compares the dipole-dipole potential of the Barnes-Hut tree with the direct summation, for one dipole per
+# needle (Needles.calc_total_energy) and for every sphere as a dipole (Needles.calc_multiple_dipoles_energy).
+# The potential of single needles (used by the steps) is compared with the direct summation as well.
+# With tree_accuracy = 0 no node is used as one dipole, so the tree has to be exact.
+# Run from the main directory: python -m validation.dipole_tree
+# -----------------------------
+
+
+def get_needles(p, seed=0):
+    """
+    Places the needles of the system. (without the output of every placed needle)
+
+    :param p: The parameters of the system. (class: Parameters)
+    :param seed: The seed of the random number generators.
+
+    :return: The needles. (class: Needles)
+    """
+
+    random.seed(seed)
+    np.random.seed(seed)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        return Needles(p)
+
+
+def compare(p, needles, accuracies):
+    """
+    Compares the tree with the direct summation.
+
+    :param p: The parameters of the system. (class: Parameters)
+    :param needles: The needles of the system. (class: Needles)
+    :param accuracies: The values of p.tree_accuracy which are compared.
+
+    Returns:
+        - direct - The dipole-dipole potential of the direct summation.
+        - tree - The dipole-dipole potential of the tree for every accuracy.
+    """
+
+    if p.multiple_dipoles:
+        direct = needles.calc_multiple_dipoles_energy(p.factor)
+    else:
+        gv = GlobalValues(p.convergence_interval_length)
+        needles.calc_total_energy(gv, p.field_vector, p.factor, False, p.cpu_improve)
+        direct = gv.E_DD
+
+    tree = []
+    for accuracy in accuracies:
+        p.tree_accuracy = accuracy
+        tree.append(DipoleTree(needles, p).calc_dd_energy(p.factor))
+
+    return direct, tree
+
+
+def compare_needles(p, needles, accuracy, ids):
+    """
+    Compares the potentials of single needles with all other needles of the tree with the direct summation.
+
+    :param p: The parameters of the system. (class: Parameters)
+    :param needles: The needles of the system. (class: Needles)
+    :param accuracy: The value of p.tree_accuracy.
+    :param ids: The ids of the compared needles.
+
+    :return: The largest difference between the tree and the direct summation.
+    """
+
+    p.tree_accuracy = accuracy
+    tree = DipoleTree(needles, p)
+    n = len(needles.get())
+
+    error = 0
+    for idx in ids:
+        others = np.delete(np.arange(n), idx)
+        direct = np.sum(needles.calc_dd_potentials(idx, others, p.factor, p.multiple_dipoles))
+        error = max(error, abs(tree.calc_dd_potential(idx, p.factor) - direct))
+
+    return error
+
+
+if __name__ == "__main__":
+    default_accuracy = Parameters().tree_accuracy
+
+    print("\nDipole Tree Validation")
+    print("-------------------------------")
+
+    for multiple_dipoles in (False, True):
+        p = Parameters()
+        p.quantity = 200
+        p.box_dimensions = np.array([12, 12, 6])
+        p.multiple_dipoles = multiple_dipoles
+
+        needles = get_needles(p)
+        direct, (exact, approximated) = compare(p, needles, [0, default_accuracy])
+        ids = np.arange(0, p.quantity, 10)
+        needle_exact = compare_needles(p, needles, 0, ids)
+        needle_approximated = compare_needles(p, needles, default_accuracy, ids)
+
+        print("Multiple Dipoles:\t{md}".format(md=multiple_dipoles))
+        print("Direct:\t\t\t{e}".format(e=direct))
+        # The total is a sum of positive and negative potentials, so the error is given per needle.
+        print("Tree (accuracy 0):\t{e} (error per needle {err})".format(e=exact, err=abs(exact - direct) / p.quantity))
+        print("Tree (accuracy {acc}):\t{e} (error per needle {err})".format(acc=default_accuracy, e=approximated,
+                                                                        err=abs(approximated - direct) / p.quantity))
+        print("Single needles:		largest error {e0} (accuracy 0), {e} (accuracy {acc})".format(
+            e0=needle_exact, e=needle_approximated, acc=default_accuracy))
+        print("-------------------------------")
+
+        if abs(exact - direct) > 1e-10 * max(abs(direct), 1):
+            print("Error: The tree with accuracy 0 is not exact")
+        if needle_exact > 1e-10 * max(abs(direct), 1):
+            print("Error: The potentials of single needles with accuracy 0 are not exact")
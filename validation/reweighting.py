@@ -0,0 +1,145 @@
+import contextlib
+import io
+import random
+
+import numpy as np
+
+from classes.Parameters import Parameters
+from classes.GlobalValues import GlobalValues
+from classes.Simulation import Simulation
+from classes.Reweighting import Reweighting
+
+# Info:
+# -----------------------------
+# Records samples at kT_1 and |B_1|, reweights them to a nearby kT_2 or |B_2| and compares the prediction with a
+# direct simulation at kT_2 and |B_2|. The error of the prediction is estimated from the effective number of
+# samples n_eff, the error of the direct simulation from its number of samples. Both assume independent samples,
+# so the box is dilute enough that the needles decorrelate within p.sample_interval steps.
+# Run from the main directory: python -m validation.reweighting
+# -----------------------------
+
+DIRECTION = np.array([1.0, 0.0, 0.0])   # The direction of the field.
+
+
+def run(kT, strength, seed=0):
+    """
+    Simulates the system until it is equilibrated and records p.production_steps / p.sample_interval samples.
+
+    :param kT: k * Temperature
+    :param strength: The strength of the field.
+    :param seed: The seed of the random number generators for the steps. (the needles are always placed the same)
+
+    Returns:
+        - p - The parameters of the simulation. (class: Parameters)
+        - gv - The global variables with the samples. (class: GlobalValues)
+    """
+
+    p = Parameters()
+    p.quantity = 8
+    p.box_dimensions = np.array([8, 8, 8])
+    p.kT = kT
+    p.field_vector = strength * DIRECTION
+    p.production_steps = 40000
+    p.sample_interval = 40
+
+    random.seed(0)
+    np.random.seed(0)
+
+    gv = GlobalValues(p.convergence_interval_length)
+    with contextlib.redirect_stdout(io.StringIO()):
+        sim = Simulation(p, gv)
+
+        random.seed(seed)
+        np.random.seed(seed)
+        for _ in range(0, 4000):
+            sim.next_step()
+        sim.sample(0)
+
+    return p, gv
+
+
+def get_observables(reweighting):
+    """
+    Gets the observables of every sample which are compared.
+
+    :param reweighting: The samples. (class: Reweighting)
+
+    :return: The dipole-dipole potential and the mean moment of one needle along the field. (array of shape 2 x n)
+    """
+
+    return np.array([reweighting.dd_energy, reweighting.moment @ DIRECTION / reweighting.quantity])
+
+
+def predict(reweighting, kT, strength):
+    """
+    Predicts the averages of the observables at another temperature and field.
+
+    :param reweighting: The samples of the reference simulation. (class: Reweighting)
+    :param kT: k * Temperature
+    :param strength: The strength of the field.
+
+    Returns:
+        - mean - The predicted averages.
+        - error - The standard errors of the predictions. (from n_eff)
+        - n_eff - The effective number of samples.
+    """
+
+    values = get_observables(reweighting)
+    w = reweighting.get_weights(kT, strength * DIRECTION)
+
+    mean = values @ w
+    n_eff = 1 / np.sum(w * w)
+    variance = (values - mean[:, None]) ** 2 @ w
+
+    return mean, np.sqrt(variance / n_eff), n_eff
+
+
+def measure(p, gv):
+    """
+    Gets the averages of the observables of a direct simulation.
+
+    :param p: The parameters of the simulation. (class: Parameters)
+    :param gv: The global variables with the samples. (class: GlobalValues)
+
+    Returns:
+        - mean - The averages.
+        - error - The standard errors of the averages.
+    """
+
+    reweighting = Reweighting()
+    reweighting.add_run(p, gv)
+    values = get_observables(reweighting)
+
+    return values.mean(axis=1), values.std(axis=1, ddof=1) / np.sqrt(values.shape[1])
+
+
+if __name__ == "__main__":
+    print("\nReweighting Validation")
+    print("-------------------------------")
+
+    kT_1, strength_1 = 1.0, 2.0
+    reference = Reweighting()
+    reference.add_run(*run(kT_1, strength_1))
+
+    for kT_2, strength_2 in ((1.1, strength_1), (kT_1, 2.5)):
+        predicted, predicted_error, n_eff = predict(reference, kT_2, strength_2)
+        direct, direct_error = measure(*run(kT_2, strength_2, seed=1))
+
+        print("kT = {kt}, |B| = {b}:\tn_eff = {n:.0f} of {total}".format(kt=kT_2, b=strength_2, n=n_eff,
+                                                                          total=reference.n[0]))
+        for k, name in enumerate(("E_DD", "m_B")):
+            print("\t{name}:\treweighted = {r:.4f} +- {dr:.4f}, direct = {d:.4f} +- {dd:.4f}".format(
+                name=name, r=predicted[k], dr=predicted_error[k], d=direct[k], dd=direct_error[k]))
+
+        if np.any(np.abs(predicted - direct) > 4 * np.sqrt(predicted_error ** 2 + direct_error ** 2)):
+            print("Error: The reweighted averages do not agree with the direct simulation")
+
+    print("-------------------------------")
+
+    strengths = np.linspace(1.5, 2.5, 5)
+    curve, n_eff = reference.get_magnetization_curve(kT_1, strengths, DIRECTION)
+    print("Magnetization curve at kT = {kt} (reweighted from |B| = {b}):".format(kt=kT_1, b=strength_1))
+    for strength, m, n in zip(strengths, curve, n_eff):
+        print("\t|B| = {b:.2f}:\tm_B = {m:.4f}\tn_eff = {n:.0f}".format(b=strength, m=m, n=n))
+
+    print("-------------------------------")
@@ -0,0 +1,117 @@
+import numpy as np
+
+from classes.Parameters import Parameters
+from classes.Needle import polar2cart_arrays, calc_segment_distances
+from classes.Needles import get_offsets
+
+# Info:
+# -----------------------------
+# Compares the spherocylinder hard core with the chain of spheres for random pairs of needles.
+# The spherocylinder contains the chain, so it has to find every overlap of the chains. It also finds
+# overlaps in the grooves between the spheres, which the chain does not.
+# Run from the main directory: python -m validation.spherocylinder
+# -----------------------------
+
+
+def get_random_needles(n, box):
+    """
+    Gets needles with random positions and directions.
+
+    :param n: The number of needles.
+    :param box: The side length of the cube of the middle spheres.
+
+    Returns:
+        - positions - The positions of the middle spheres. (array of shape n x 3)
+        - units - The directions of the needles. (array of shape n x 3)
+    """
+
+    positions = np.random.uniform(0, box, (n, 3))
+    theta = np.arccos(2 * np.random.random(n) - 1)
+    phi = np.random.random(n) * 2. * np.pi
+
+    return positions, polar2cart_arrays(theta, phi, 1)
+
+
+def compare_models(pairs=3000, seed=0):
+    """
+    Compares the overlaps of both hard core models for random pairs of needles of the default shape.
+
+    :param pairs: The number of pairs.
+    :param seed: The seed of the random number generator.
+
+    Returns:
+        - both - The number of pairs where both models find an overlap.
+        - only_spheres - The number of overlaps only found by the chain of spheres. (must be 0)
+        - only_spherocylinder - The number of overlaps only found by the spherocylinder. (grooves)
+    """
+
+    np.random.seed(seed)
+    length, radius = Parameters().calculate_needle_dimensions()
+    offsets = get_offsets(length, radius)
+    box = 2 * radius * (2 * length + 1)   # The length of one needle.
+
+    p1, u1 = get_random_needles(pairs, box)
+    p2, u2 = get_random_needles(pairs, box)
+
+    # Chain of spheres: every sphere of the first needle with every sphere of the second needle.
+    r = ((p1 - p2)[:, None, None, :] + offsets[None, :, None, None] * u1[:, None, None, :]
+         - offsets[None, None, :, None] * u2[:, None, None, :])
+    spheres = np.any(np.sum(r * r, axis=3) <= (2 * radius) ** 2, axis=(1, 2))
+
+    # Spherocylinder: the distance of the segments through the middle points of the outer spheres.
+    h = 2 * radius * length
+    spherocylinder = calc_segment_distances(p1, u1, h, p2, u2, h) <= 2 * radius
+
+    return (int(np.sum(spheres & spherocylinder)), int(np.sum(spheres & ~spherocylinder)),
+            int(np.sum(~spheres & spherocylinder)))
+
+
+def check_segment_distances(pairs=2000, samples=201, seed=0):
+    """
+    Compares the closed-form segment distance with the minimum over points sampled along both segments.
+    The sampled distance is never smaller than the exact one and close to it.
+
+    :param pairs: The number of pairs of segments.
+    :param samples: The number of points along every segment.
+    :param seed: The seed of the random number generator.
+
+    Returns:
+        - min - The smallest difference (sampled - closed form), must not be negative.
+        - max - The largest difference (sampled - closed form), about the spacing of the points.
+    """
+
+    rng = np.random.default_rng(seed)
+    differences = []
+
+    for k in range(0, pairs):
+        p1, p2, u1, u2 = rng.standard_normal((4, 3))
+        u1 /= np.linalg.norm(u1)
+        u2 = u1.copy() if k % 3 == 0 else u2 / np.linalg.norm(u2)  # Parallel segments are a special case.
+        h1, h2 = 2 * rng.random(2)
+
+        a = p1 + np.linspace(-h1, h1, samples)[:, None] * u1
+        b = p2 + np.linspace(-h2, h2, samples)[:, None] * u2
+        sampled = np.min(np.linalg.norm(a[:, None, :] - b[None, :, :], axis=2))
+        closed_form = calc_segment_distances(p1, u1, h1, p2, u2, h2)
+
+        differences.append(sampled - closed_form)
+
+    return min(differences), max(differences)
+
+
+if __name__ == "__main__":
+    both, only_spheres, only_spherocylinder = compare_models()
+    d_min, d_max = check_segment_distances()
+
+    print("\nSpherocylinder Validation")
+    print("-------------------------------")
+    print("Overlaps (both):\t\t{n}".format(n=both))
+    print("Only chain of spheres:\t{n}".format(n=only_spheres))
+    print("Only spherocylinder:\t{n} (grooves)".format(n=only_spherocylinder))
+    print("Segment distance:\t{d_min} ... {d_max} (sampled - closed form)".format(d_min=d_min, d_max=d_max))
+    print("-------------------------------")
+
+    if only_spheres > 0:
+        print("Error: The spherocylinder misses overlaps of the chain of spheres")
+    if d_min < -1e-12:
+        print("Error: The closed-form segment distance is too large")